@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""Latency and allocations of reflex-curses' hot paths.
+
+Usage: bench.py [--runs 200] [--only name]
+
+Requests go to mock_api, drawing goes to a fake curses screen, and everything
+runs in a throwaway HOME, so no terminal, network or config of yours is touched.
+Reports p50/p99 per call, and the peak memory and blocks still allocated after one call.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from os import environ, makedirs, path, unlink
+from types import SimpleNamespace
+
+import mock_api
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "reflex_curses"))
+import reflex  # noqa: E402
+
+LINES, COLS = 50, 200
+
+
+class FakeWindow:
+    """Stands in for a curses window, counting the calls that would draw."""
+
+    def __init__(self, lines=LINES, cols=COLS):
+        self.size = (lines, cols)
+        self.draws = 0
+
+    def getmaxyx(self):
+        return self.size
+
+    def addnstr(self, *args):
+        self.draws += 1
+
+    addstr = hline = border = addnstr
+
+    def clear(self, *args):
+        pass
+
+    erase = refresh = noutrefresh = keypad = timeout = move = clear
+
+
+def fake_curses():
+    """Just enough of the curses module for Interface."""
+    return SimpleNamespace(
+        initscr=FakeWindow,
+        newwin=lambda lines, cols, y, x: FakeWindow(lines, cols),
+        doupdate=lambda: None,
+        noecho=lambda: None,
+        echo=lambda: None,
+        cbreak=lambda: None,
+        curs_set=lambda visibility: None,
+        has_colors=lambda: False,
+        A_UNDERLINE=0,
+        ACS_HLINE=0,
+    )
+
+
+def make_home(home, port):
+    """Write a config pointing at the mock api."""
+    config_dir = path.join(home, ".config", "reflex-curses")
+    makedirs(config_dir)
+    with open(path.join(config_dir, "config"), "w") as file:
+        file.write(f"[twitch]\napi_url = http://127.0.0.1:{port}/kraken/\ncache_size = 0\n")
+
+
+def write_followed(home, count, resolved=True):
+    """Write a followed list of count channels, with their IDs unless resolved is False.
+    Unresolved lists start with the names mock_api knows, the rest are unknown to it."""
+    with open(path.join(mock_api.FIXTURES, "kraken", "users.json"), "r") as file:
+        known = [i["name"] for i in json.load(file)["users"]]
+
+    file_path = path.join(home, ".config", "reflex-curses", "followed")
+    if path.isfile(file_path + ".log"):
+        unlink(file_path + ".log")  # IDs resolved by an earlier run are logged
+    with open(file_path, "w") as file:
+        for i in range(count):
+            if resolved:
+                file.write(f"channel{i} {100000 + i}\n")
+            else:
+                file.write(f"{known[i] if i < len(known) else f'channel{i}'}\n")
+
+
+def measure(func, runs, setup=None):
+    """Time func over runs calls, then trace the allocations of one more.
+    setup runs untimed before each call."""
+    times = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter_ns()
+        func()
+        times.append(time.perf_counter_ns() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    func()
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    blocks = sum(i.count_diff for i in after.compare_to(before, "filename") if i.count_diff > 0)
+    times.sort()
+    return {
+        "p50": statistics.median(times) / 1000,
+        "p99": times[min(len(times) - 1, len(times) * 99 // 100)] / 1000,
+        "peak": peak / 1024,
+        "blocks": blocks,
+    }
+
+
+def report(name, result):
+    print(
+        f"{name:<28} p50 {result['p50']:10.1f}us  p99 {result['p99']:10.1f}us"
+        f"  peak {result['peak']:8.1f}KiB  blocks {result['blocks']:6}"
+    )
+
+
+def run(benchmarks, runs, only):
+    """Measure and report (name, func, setup) benchmarks, skipping names not starting with only.
+    Benchmarks are generators, so each one's setup happens just before it is measured."""
+    for name, func, setup in benchmarks:
+        if name.startswith(only):
+            report(name, measure(func, runs, setup))
+
+
+def records(kind, count):
+    """Made up records to fill views with."""
+    if kind == "top":
+        return [reflex.Game(name=f"Game {i}", viewers=1000 - i, channels=i) for i in range(count)]
+    if kind == "streams":
+        return [
+            reflex.Stream(
+                name=f"channel{i}",
+                display_name=f"Channel{i}",
+                channel_id=str(i),
+                url=f"https://www.twitch.tv/channel{i}",
+                game="Just Chatting",
+                viewers=1000 - i,
+                status="A stream title long enough to need wrapping over a few lines " * 2,
+                language="en",
+            )
+            for i in range(count)
+        ]
+    return [
+        reflex.Vod(
+            name=f"channel{i}",
+            channel_id=str(i),
+            title=f"Vod {i}",
+            url=f"https://www.twitch.tv/videos/{i}",
+            game="Just Chatting",
+            views=i,
+            length=3600 + i,
+            created_at="2020-01-01T00:00:00Z",
+            status="recorded",
+        )
+        for i in range(count)
+    ]
+
+
+def bench_followed(home):
+    """Loading followed lists, with every ID already resolved,
+    then with none, so they are looked up from mock_api in batches."""
+    def new_config():
+        reflex.config = reflex.Config()
+
+    for count in (10, 1000, 10000):
+        write_followed(home, count)
+        yield f"init_followed_list {count}", lambda: reflex.config.init_followed_list(), new_config
+
+    for count in (10, 1000):
+
+        def unresolved():
+            write_followed(home, count, resolved=False)
+            new_config()
+
+        yield (
+            f"init_followed_list {count} ids",
+            lambda: reflex.config.init_followed_list(),
+            unresolved,
+        )
+    write_followed(home, 0)
+
+
+def bench_requests():
+    """Requests answered by mock_api, blocking like in the CLI."""
+    twitch = reflex.twitch
+    reflex.ui = None  # Requests block without the TUI, so they can be timed
+
+    for name, req in (("topgames", ["topgames", None]), ("channel", ["channel", "23161357"])):
+        yield f"prep_url {name}", lambda: twitch.prep_url(list(req)), None
+        yield f"request {name}", lambda: twitch.request(list(req)), None
+
+
+def bench_retries():
+    """A third of the responses are 500s, which are retried after a short backoff."""
+    twitch = reflex.twitch
+    server = mock_api.serve(error_rate=0.3)
+    old_url = twitch.api.base_url
+    twitch.api.base_url = f"http://127.0.0.1:{server.server_address[1]}/kraken/"
+    try:
+        yield "request 30% errors", lambda: twitch.request(["topgames", None]), None
+    finally:
+        twitch.api.base_url = old_url
+        server.shutdown()
+
+
+def bench_timeouts():
+    """mock_api answers slower than the request timeout, so every attempt times out
+    and is retried after a backoff, until retry_limit gives up."""
+    twitch = reflex.twitch
+    server = mock_api.serve(delay=0.2)
+    old_url, old_timeout = twitch.api.base_url, twitch.timeout
+    twitch.api.base_url = f"http://127.0.0.1:{server.server_address[1]}/kraken/"
+    twitch.timeout = 0.05
+    try:
+        yield "request timeouts", lambda: twitch.request(["topgames", None]), None
+    finally:
+        twitch.api.base_url = old_url
+        twitch.timeout = old_timeout
+        server.shutdown()
+
+
+def bench_cached():
+    """Answering from the response cache, which is only used with the TUI running."""
+    twitch = reflex.twitch
+    twitch.responses = reflex.Cache(64)
+
+    # With the TUI up the request runs in the background, wait for it to be cached
+    twitch.request(["topgames", None])
+    twitch.pending[0].result()
+    twitch.poll()
+    _, url = twitch.prep_url(["topgames", None])
+    assert twitch.responses.get(url), "response wasn't cached"
+
+    lookups = dict(twitch.stats.cache)
+    yield "request cache hit", lambda: twitch.request(["topgames", None]), None
+    # Skipped by --only, nothing was looked up
+    missed = [k for k, v in twitch.stats.cache.items() if k != "hit" and v != lookups[k]]
+    assert not twitch.pending and not missed, "lookups weren't cache hits"
+    twitch.responses = reflex.Cache(0)
+
+
+def bench_ui():
+    """Slicing and drawing a page out of 1000 results in each view.
+    Draws are measured in full, after moving the selection, and with nothing changed."""
+    twitch, ui = reflex.twitch, reflex.ui
+
+    def move():
+        """Move the selection a row, like holding j/k."""
+        ui.sel = 4 if ui.sel == 3 else 3
+        ui.set_cur_page()
+
+    for state, kind in (("top", "top"), ("search", "streams"), ("vods", "videos")):
+        twitch.data = {"_total": 1000, kind: records(kind, 1000), "_next": None}
+        twitch.query = ["game", "Just%20Chatting"] if state == "search" else ["vods", "1"]
+        ui.state = state
+        ui.page, ui.sel = 10, 3
+        ui.set_cur_page()
+
+        yield f"set_cur_page {state}", ui.set_cur_page, None
+        yield f"set_results {state}", twitch.set_results, None
+        yield f"draw_win_l {state}", ui.draw_win_l, ui.redraw_all
+        yield f"draw_win_r {state}", ui.draw_win_r, ui.redraw_all
+        yield f"draw_win_l {state} move", ui.draw_win_l, move
+        yield f"draw_win_r {state} move", ui.draw_win_r, move
+        yield f"draw_win_l {state} idle", ui.draw_win_l, None
+
+    def type_filter():
+        """Type the next character of "chan0", starting over after the last one."""
+        typed = len(twitch.filter) % 5
+        twitch.filter = "chan0"[: typed + 1]
+
+    ui.state = "search"
+    twitch.data = {"_total": 1000, "streams": records("streams", 1000), "_next": None}
+    yield "items filter", twitch.items, type_filter
+    twitch.filter, twitch.sort = "", "viewers"
+    yield "items sort viewers", twitch.items, twitch.changed
+    twitch.sort = "default"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reflex-curses' hot paths.")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--only", default="", help="only run benchmarks starting with this")
+    args = parser.parse_args()
+
+    server = mock_api.serve()
+    with tempfile.TemporaryDirectory() as home:
+        environ.update(HOME=home, XDG_CACHE_HOME=home, XDG_RUNTIME_DIR=home)
+        make_home(home, server.server_address[1])
+        write_followed(home, 0)
+        reflex.setup()
+
+        run(bench_followed(home), args.runs, args.only)
+        run(bench_requests(), args.runs, args.only)
+        run(bench_retries(), max(args.runs // 10, 1), args.only)
+        run(bench_timeouts(), max(args.runs // 50, 1), args.only)
+
+        reflex.curses = fake_curses()
+        reflex.ui = reflex.Interface()
+        run(bench_cached(), args.runs, args.only)
+        run(bench_ui(), args.runs, args.only)
+
+    print(f"mock api hits: {server.hits}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Local stand-in for the twitch api, serving recorded responses from fixtures/.
+
+Usage: mock_api.py [--port 8000] [--delay seconds] [--error-rate 0.0-1.0]
+
+Point reflex-curses at it with the api_url option in the [twitch] config section:
+
+    api_url = http://127.0.0.1:8000/kraken/
+
+or http://127.0.0.1:8000/helix/ with api = helix.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import path
+from socketserver import ThreadingMixIn
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES = path.join(path.dirname(path.abspath(__file__)), "fixtures")
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """Threaded server, so parallel requests from reflex-curses don't queue up."""
+
+    daemon_threads = True
+
+    def __init__(self, address, delay=0.0, error_rate=0.0):
+        super().__init__(address, Handler)
+        self.delay = delay
+        self.error_rate = error_rate
+        self.hits = 0
+
+    def handle_error(self, request, client_address):
+        """Clients giving up on a slow response, as timeouts do, aren't errors here."""
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Maps request paths to fixture files, numeric path segments match "_".
+    e.g. /kraken/channels/123/videos serves fixtures/kraken/channels/_/videos.json
+    """
+
+    def do_GET(self):
+        """Serve the fixture for the path, filtered by the query's channels/logins."""
+        self.server.hits += 1
+        url = urlparse(self.path)
+        args = parse_qs(url.query)
+
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        if random.random() < self.server.error_rate:
+            self.send_error(500)
+            return
+
+        segments = ["_" if i.isdigit() else i for i in url.path.strip("/").split("/")]
+        file_path = path.join(FIXTURES, *segments) + ".json"
+        if not path.isfile(file_path):
+            self.send_error(404)
+            return
+
+        with open(file_path, "r") as file:
+            data = filter_fixture(json.load(file), args)
+
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Keep quiet, benchmarks run this in the same terminal."""
+
+
+def filter_fixture(data, args):
+    """Only return the recorded channels/users the request asked for."""
+    if "channel" in args:
+        ids = args["channel"][0].split(",")
+        data["streams"] = [i for i in data["streams"] if str(i["channel"]["_id"]) in ids]
+        data["_total"] = len(data["streams"])
+    elif "user_id" in args and "data" in data:
+        data["data"] = [i for i in data["data"] if i["user_id"] in args["user_id"]]
+    elif "login" in args:
+        logins = [j for i in args["login"] for j in i.split(",")]
+        if "users" in data:
+            data["users"] = [i for i in data["users"] if i["name"] in logins]
+            data["_total"] = len(data["users"])
+        else:
+            data["data"] = [i for i in data["data"] if i["login"] in logins]
+    return data
+
+
+def serve(port=0, delay=0.0, error_rate=0.0):
+    """Start the server on a background thread, returns it.
+    Port 0 picks a free port, see server.server_address.
+    """
+    server = Server(("127.0.0.1", port), delay, error_rate)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded twitch api responses.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait per request")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500"
+    )
+    args = parser.parse_args()
+
+    server = Server(("127.0.0.1", args.port), args.delay, args.error_rate)
+    print(f"Serving on http://127.0.0.1:{args.port}/kraken/ and /helix/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""Wall time of reflex-curses CLI commands, from process start to exit.
+
+Usage: startup.py [--runs 20]
+
+-f is timed against mock_api, both fetching directly and asking a running daemon.
+Everything runs in a throwaway HOME, your config and followed list are left alone.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import environ, makedirs, path
+
+import mock_api
+
+REFLEX = path.join(path.dirname(path.abspath(__file__)), "..", "reflex_curses", "reflex.py")
+
+
+def make_home(home, port):
+    """Write a config pointing at the mock api, and follow the recorded streams."""
+    config_dir = path.join(home, ".config", "reflex-curses")
+    makedirs(config_dir)
+
+    with open(path.join(config_dir, "config"), "w") as file:
+        file.write(f"[twitch]\napi_url = http://127.0.0.1:{port}/kraken/\n")
+
+    with open(path.join(mock_api.FIXTURES, "kraken", "streams.json"), "r") as file:
+        streams = json.load(file)["streams"]
+    with open(path.join(config_dir, "followed"), "w") as file:
+        for stream in streams:
+            file.write(f"{stream['channel']['name']} {stream['channel']['_id']}\n")
+
+
+def time_command(args, env, runs):
+    """Run reflex-curses with args, returns the wall time of each run in ms."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, REFLEX, *args], env=env, stdout=subprocess.DEVNULL, check=True
+        )
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def start_daemon(env, socket_path):
+    """Start reflex-curses -D, returns once it is listening."""
+    daemon = subprocess.Popen(
+        [sys.executable, REFLEX, "-D"], env=env, stdout=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 10
+    while not path.exists(socket_path):
+        if time.monotonic() > deadline or daemon.poll() is not None:
+            daemon.kill()
+            raise RuntimeError("daemon didn't start")
+        time.sleep(0.05)
+    return daemon
+
+
+def report(name, times):
+    print(
+        f"{name:<12} min {min(times):7.1f}  p50 {statistics.median(times):7.1f}"
+        f"  max {max(times):7.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time reflex-curses CLI commands.")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    server = mock_api.serve()
+    with tempfile.TemporaryDirectory() as home:
+        make_home(home, server.server_address[1])
+        env = dict(environ, HOME=home, XDG_CACHE_HOME=home, XDG_RUNTIME_DIR=home)
+
+        report("-v", time_command(["-v"], env, args.runs))
+        report("-h", time_command(["-h"], env, args.runs))
+        report("-f", time_command(["-f"], env, args.runs))
+
+        daemon = start_daemon(env, path.join(home, "reflex-curses.sock"))
+        try:
+            report("-f daemon", time_command(["-f"], env, args.runs))
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,28 +3,77 @@
 # TODO Getting Big, Separate into different modules
 
 import configparser
-import curses
+import json
+import re
 import shlex
+import signal
 import sys
-from os import path, makedirs
-from random import randint
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping, Sequence
+from contextlib import contextmanager
+from io import StringIO
+from os import environ, fchmod, fsync, killpg, path, pread, makedirs, replace, stat, unlink
+from random import randint, uniform
 from shutil import copyfile
-from subprocess import Popen, PIPE, DEVNULL
-from textwrap import wrap
-from time import sleep
+from stat import S_IMODE
+from subprocess import Popen, PIPE, DEVNULL, STDOUT
+from threading import Event, Lock, Thread, local
+from time import monotonic, perf_counter, sleep, time
 from urllib.parse import quote, unquote
 
-import requests
+# Both are imported on first use, CLI commands mostly need neither
+curses = None  # see main()
+requests = None  # see Query.session
+
+# Other modules only some commands need are imported where they are used,
+# so -v and -h don't pay for them
 
 VERSION = "0.9.4"
 
+# Max number of logins the users endpoint accepts per request
+ID_BATCH_SIZE = 100
+
+# Seconds the selection has to stay put before the views it leads to are prefetched
+PREFETCH_DELAY = 0.5
+
+# Seconds before the first retry of a failed request, doubling for each retry after up to the cap
+RETRY_BASE = 0.5
+RETRY_CAP = 10
+
+# Share of the rate limit quota bulk requests leave to interactive ones
+BULK_RESERVE = 0.2
+
+# Orders the shown results can be sorted in, "default" keeps the api's order
+SORTS = ("default", "viewers", "name", "uptime")
+
+# Seconds the qualities streamlink lists for a stream are kept
+QUALITY_TTL = 300
+
+# Seconds a cached response stays fresh, by query type
+CACHE_TTL = {
+    "topgames": 300,
+    "topstreams": 60,
+    "game": 60,
+    "stream": 60,
+    "channel": 30,
+    "vods": 300,
+}
+
 
 class Config:
     """Configuration Variables and Locally Followed Twitch Channels."""
 
     def __init__(self):
         self.config_dir = path.expanduser("~/.config/reflex-curses")
-        self.followed = {}
+        self.cache_dir = path.join(
+            environ.get("XDG_CACHE_HOME", path.expanduser("~/.cache")), "reflex-curses"
+        )
+        self.socket_path = path.join(
+            environ.get("XDG_RUNTIME_DIR", self.cache_dir), "reflex-curses.sock"
+        )
+        self.followed = Followed(f"{self.config_dir}/followed")
+        self.unknown = []
         self.cp = configparser.ConfigParser()
 
         # Setup Default Values
@@ -34,17 +83,23 @@ class Config:
             "delete": "d",  # Delete channel from followed list
             "followed": "f",  # Switch to followed view
             "game": "g",  # Search by Game Name (exact)
-            "back": "h",  # Go to initial view
+            "back": "h",  # Go to previous view
+            "ahead": "L",  # Go forward again after going back
             "import": "i",  # Import follows from twitch user
             "down": "j",  # Move cursor down
+            "filter": "F",  # Filter the shown results as you type
             "up": "k",  # Move cursor up
             "forward": "l",  # Enter menu or launch stream
             "online": "o",  # Toggle online/all streams in followed list
+            "sort": "O",  # Cycle sorting the shown results: default/viewers/name/uptime
             "quit": "q",  # Quit
             "refresh": "r",  # Resend last query
+            "replace": "R",  # Launch stream in place of the last one started
             "t_stream": "s",  # Go to top streams view
             "t_game": "t",  # Go to top games view
             "search": "/",  # Search for streams
+            "stats": "S",  # Toggle request/draw stats in the right window
+            "stop": "x",  # Stop the selected stream's player
             "vods": "v",  # Go to VOD view
             "yank": "y",  # Yank channel url
             "page+": "n",  # Next Page
@@ -56,22 +111,37 @@ class Config:
         self.cp["exec"] = {
             "browser": "firefox --new-window",
             "chat_method": "browser",  # browser/weechat/irc
+            "list_qualities": "True",  # Ask streamlink for the selected stream's qualities
+            "max_streams": 0,  # Max number of streams playing at once, 0 for no limit
             "player": "mpv --force-window=yes",
             "streamlink": "streamlink -t '{author} - {title}' --twitch-disable-hosting --twitch-disable-ads",
             "term": "urxvt -e",
         }
 
         self.cp["twitch"] = {
+            "api": "kraken",  # Twitch api version: kraken/helix
+            "api_url": "",  # Override the api's base url, e.g. for a local mock server
+            "cache_size": 64,  # Max number of responses kept in memory, 0 to disable
             "client_id": "caozjg12y6hjop39wx996mxn585yqyk",
+            "daemon_refresh": 60,  # Seconds between the daemon's checks of followed streams
             "lang": "",  # Language filter
+            "pool_size": 8,  # Max number of open connections/parallel requests
+            "prefetch": 2,  # Max number of requests for prefetching views, 0 to disable
             # API limit is 100, but API seems to choke at higher than 75
             "results_limit": 75,  # Max number of results for a query
             "retry_limit": 3,  # Max number of retries for a query
+            "stats_log": "",  # File to append a json line to for each request, blank for none
+            "timeout": 5,  # Seconds to wait on the api before a request's attempt fails
+            "token": "",  # OAuth token, required by helix
         }
 
         self.cp["ui"] = {
             # Supported Colors: black/blue/cyan/green/magenta/white/yellow/red
             "default_state": "games",  # Initial view: games/followed/streams
+            "follow_refresh": 60,  # Seconds between refreshing online follows, 0 to disable
+            "infinite_scroll": "True",  # Load more results when nearing the end of the list
+            "history_size": 50,  # Max number of views to remember for going back
+            "history_data": 10,  # Max number of views around the current one to keep results for
             "hl_color": "blue",  # Color of selected item highlight
             "l_win_color": "white",  # Color of left window
             "r_win_color": "green",  # Color of right window
@@ -87,68 +157,264 @@ class Config:
             "port": "6697",  # Port of the irc server, weechat only
         }
 
-        # Read in Config File
-        self.cp.read(self.config_dir + "/config")
+        # Read in Config File, keeping its text to tell if it needs writing
+        self.saved = None
+        file_path = self.config_dir + "/config"
+        if path.isfile(file_path):
+            with open(file_path, "r") as file:
+                self.saved = file.read()
+            self.cp.read_string(self.saved, file_path)
 
     def write_config(self):
-        """Writes config to file"""
-        with open(self.config_dir + "/config", "w") as configfile:
-            self.cp.write(configfile)
+        """Writes config to file, if it changed or gained new options"""
+        text = StringIO()
+        self.cp.write(text)
+        if text.getvalue() == self.saved:
+            return
+
+        write_atomic(self.config_dir + "/config", text.getvalue())
+        self.saved = text.getvalue()
 
     def init_followed_list(self):
-        """Loads the file containing followed channels.
+        """Loads the followed channels, see Followed for the files.
         Will make config_dir if it doesn't exist.
-        File Format: 'channel_name twitch_api_id'
         """
-        file_path = f"{self.config_dir}/followed"
-
         if not path.isdir(self.config_dir):
             makedirs(self.config_dir)
-        if path.isfile(file_path):
-            file = open(file_path, "r")
-            for line in file:
-                (name, api_id) = (line.split() + [None])[:2]
-                # Fetch IDs if we dont have one
-                # TODO Batch Requests?
-                if api_id is None:
-                    api_id = twitch.get_twitch_id(name)
-
-                self.followed[name] = api_id
-            file.close()
-
-    def import_follows_from_user(self, username, overwrite=False):
-        """Adds twitch user's follow list to your own"""
+        self.followed.load()
+
+        # Fetch IDs if we dont have one, they are logged for next time
+        missing = [name for name, api_id in self.followed.items() if api_id is None]
+        if missing:
+            self.resolve_followed_ids(missing)
+
+    def resolve_followed_ids(self, names):
+        """Resolve IDs for the given followed names in batches.
+        Names twitch doesn't know, like typos or renamed channels, are kept without an ID
+        and listed in unknown. They and names that failed to resolve due to network errors
+        are tried again on the next run.
+        """
+        resolved = twitch.get_twitch_ids(names)
+        if not resolved:
+            return
+
+        for name in names:
+            if resolved.get(name.lower()):
+                self.followed[name] = resolved[name.lower()]
+            elif name.lower() in resolved:
+                self.unknown.append(name)
+
+    def import_follows_from_user(self, username, overwrite=False, progress=None):
+        """Adds twitch user's follow list to your own.
+        Pages are merged in as they arrive, progress(fetched, total) is called after each.
+        Returns (fetched, total), or None if the user or their follows weren't found.
+        """
 
         user_id = twitch.get_twitch_id(username)
-        twitch.request(["get_follows", user_id])
+        if not user_id:
+            return None
 
-        if not twitch.data:
-            return
+        return self.merge_follows(twitch.get_follows(user_id), overwrite, progress)
 
-        if overwrite:
-            config.followed = {}
+    def merge_follows(self, pages, overwrite=False, progress=None):
+        """Adds (follows, total) pages from Query.get_follows to your follow list.
+        Returns (fetched, total), or None if there were no pages.
+        """
+        fetched = 0
+        total = None
+
+        for follows, total in pages or []:
+            if overwrite and fetched == 0:
+                self.followed.clear()
+
+            for name, api_id in follows:
+                if name not in self.followed:
+                    self.followed[name] = api_id
+
+            fetched += len(follows)
+            if progress:
+                progress(fetched, total)
+
+        if total is None:
+            return None
 
-        # TODO Paginate follows > results_limit
-        for result in twitch.data["follows"]:
-            # print(f'{follow["channel"]["name"]}: {follow["channel"]["_id"]}')
-            if result["channel"]["name"] not in config.followed:
-                config.followed[result["channel"]["name"]] = str(result["channel"]["_id"])
+        return (fetched, total)
+
+    def followed_ids(self):
+        """Returns the resolved IDs of followed channels, comma separated."""
+        return self.followed.id_string()
 
     def write_followed_list(self):
-        """Write followed channels list to file, backing up old one."""
-        file_path = f"{self.config_dir}/followed"
-        self.backup(file_path)
+        """Fold the changes logged this session into the followed list file."""
+        self.followed.compact()
+
+
+class Followed(MutableMapping):
+    """Followed channels, mapping names to twitch API IDs (None until resolved).
+    Keeps an index of names by ID, and tags to group channels by.
+
+    The list is saved in file_path, one 'channel_name twitch_api_id #tag ...' per line.
+    Changes since are appended to file_path.log, so following one channel writes one line,
+    and compact() folds the log back into the list with an atomic rename. Log lines set
+    or remove a whole entry, replaying them twice gives the same list, so a crash at any
+    point loses at most the line being written.
+    """
+
+    # Log more lines than this, or than there are channels, and load() compacts
+    MAX_LOG = 100
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.log_path = file_path + ".log"
+        self.log = None
+        self.logged = 0
+        self.ids = {}
+        self.names = {}
+        self.tags = {}
+        self.joined = None
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+    def __setitem__(self, name, api_id):
+        self.set(name, api_id)
+        self.write_log(f"+ {name} {api_id or ''}".rstrip())
+
+    def __delitem__(self, name):
+        self.remove(name)
+        self.write_log(f"- {name}")
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def clear(self):
+        self.ids, self.names, self.tags, self.joined = {}, {}, {}, None
+        self.write_log("*")
+
+    def set(self, name, api_id):
+        """Add or update a channel without logging it."""
+        old = self.ids.get(name)
+        if old and self.names.get(old) == name:
+            del self.names[old]
+        self.ids[name] = api_id
+        if api_id:
+            self.names[api_id] = name
+        self.joined = None
+
+    def remove(self, name):
+        """Remove a channel without logging it."""
+        api_id = self.ids.pop(name)
+        if api_id and self.names.get(api_id) == name:
+            del self.names[api_id]
+        self.tags.pop(name, None)
+        self.joined = None
+
+    def name_of(self, api_id):
+        """Returns the followed name with the ID, or None."""
+        return self.names.get(api_id)
+
+    def id_string(self):
+        """Returns the resolved IDs, comma separated. Kept until the list changes."""
+        if self.joined is None:
+            self.joined = ",".join(api_id for api_id in self.ids.values() if api_id)
+        return self.joined
+
+    def tag(self, name, tags):
+        """Replace the tags of a followed channel, no tags removes them."""
+        if tags:
+            self.tags[name] = set(tags)
+        else:
+            self.tags.pop(name, None)
+        self.write_log(" ".join(["#", name, *sorted(tags)]))
+
+    def load(self):
+        """Read the list, then replay the log on top of it."""
+        if path.isfile(self.file_path):
+            with open(self.file_path, "r") as file:
+                for line in file:
+                    self.read_entry(line.split())
+
+        if path.isfile(self.log_path):
+            torn = False
+            with open(self.log_path, "r") as file:
+                for line in file:
+                    # A line without its newline was cut off by a crash
+                    torn = not line.endswith("\n")
+                    if not torn:
+                        self.replay(line.split())
+                        self.logged += 1
+
+            # Cut it off for good, so the next change isn't appended onto it
+            if torn:
+                with open(self.log_path, "r+b") as file:
+                    file.truncate(file.read().rfind(b"\n") + 1)
+
+            if self.logged > max(self.MAX_LOG, len(self)):
+                self.compact()
+
+    def read_entry(self, fields):
+        """Add a 'channel_name twitch_api_id #tag ...' line of the list."""
+        if not fields:
+            return
 
-        file = open(file_path, "w")
-        for i in sorted(self.followed, key=str.lower):
-            file.write(f"{i} {self.followed[i]}\n")
-        file.close()
+        name, rest = fields[0], fields[1:]
+        tags = [i[1:] for i in rest if i.startswith("#")]
+        api_id = next((i for i in rest if not i.startswith("#")), None)
+        self.set(name, api_id)
+        if tags:
+            self.tags[name] = set(tags)
 
-    def backup(self, file_path):
-        """Takes input path, copies file to file.old."""
-        if path.isfile(file_path):
-            backup_path = file_path + ".old"
-            copyfile(file_path, backup_path)
+    def replay(self, fields):
+        """Apply a line of the log."""
+        if not fields:
+            return
+
+        if fields[0] == "+" and len(fields) > 1:
+            self.set(fields[1], (fields[2:] or [None])[0])
+        elif fields[0] == "-" and len(fields) > 1 and fields[1] in self.ids:
+            self.remove(fields[1])
+        elif fields[0] == "#" and len(fields) > 1 and fields[1] in self.ids:
+            self.tags.pop(fields[1], None)
+            if fields[2:]:
+                self.tags[fields[1]] = set(fields[2:])
+        elif fields[0] == "*":
+            self.ids, self.names, self.tags, self.joined = {}, {}, {}, None
+
+    def write_log(self, line):
+        """Append a change to the log, flushed so it survives a crash of the TUI."""
+        if self.log is None:
+            self.log = open(self.log_path, "a")
+        self.log.write(line + "\n")
+        self.log.flush()
+        self.logged += 1
+
+    def compact(self):
+        """Write the list with the logged changes to file_path, backing up the old one,
+        then start a new log."""
+        if not self.logged:
+            return
+
+        lines = []
+        for name in sorted(self.ids, key=str.lower):
+            # Unresolved IDs are left blank to be fetched on next start
+            fields = [name, self.ids[name] or ""]
+            fields += [f"#{i}" for i in sorted(self.tags.get(name, ()))]
+            lines.append(" ".join(i for i in fields if i) + "\n")
+
+        if path.isfile(self.file_path):
+            copyfile(self.file_path, self.file_path + ".old")
+        write_atomic(self.file_path, "".join(lines))
+
+        # Replaying the log onto the new list changes nothing, so a crash here is harmless
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        if path.isfile(self.log_path):
+            unlink(self.log_path)
+        self.logged = 0
 
 
 class Interface:
@@ -160,6 +426,8 @@ class Interface:
         curses.cbreak()
         curses.curs_set(0)
         self.screen.keypad(1)
+        # Don't block on input, so finished requests can be drawn
+        self.screen.timeout(100)
 
         if curses.has_colors():
             colorlist = {
@@ -188,18 +456,33 @@ class Interface:
 
         self.state = "top"
         self.f_filter = "online"
+        self.show_stats = False
+        self.filtering = False
 
+        # Used until streamlink has listed the selected stream's qualities
         self.quality = ["audio_only", "worst", "360p", "480p", "720p", "1080p", "best"]
-        self.cur_quality = self.quality.index(config.cp["ui"]["quality"])
+        self.cur_quality = config.cp["ui"]["quality"]
 
         self.cache = 0
         self.cur_page = []
         self.donothing = False
         self.maxitems = 0
         self.page = 0
-        self.page_cache = 0
         self.sel = 0
-        self.sel_cache = 0
+
+        # What each window shows, so draws can skip or repaint only what changed
+        self.drawn_l = None
+        self.drawn_r = None
+        self.wrap_cache = {}
+
+        # Row labels of the shown data, by item, for the view in labels_view
+        self.labels = {}
+        self.labels_view = None
+
+        self.key_help = self.build_key_help()
+        self.quality_help = f"quality: {config.cp['keys']['qual-']}{config.cp['keys']['qual+']}"
+
+        self.launcher = Launcher()
 
         self.init_screen()
 
@@ -207,6 +490,7 @@ class Interface:
         """Initializes the screen.
         Is also called when the terminal is resized.
         """
+        self.redraw_all()
         self.screen.clear()
         self.size = self.screen.getmaxyx()
         if self.check_term_size():
@@ -250,22 +534,33 @@ class Interface:
         state is used to determine what kind of data is shown.
         """
         self.state = new_state
-        self.sel_cache = self.sel
-        self.page_cache = self.page
         self.reset_page()
 
     def win_blink(self):
         """Visually blink the screen."""
+        self.redraw_all()
         self.screen.clear()
         self.screen.refresh()
 
-    def reset_page(self, reset_cache=False):
-        """Reset selection and page number, optionally resets cache as well."""
+    def redraw_all(self):
+        """Forget what the windows show, so the next draw repaints them fully.
+        Needed after anything else draws over them."""
+        self.drawn_l = None
+        self.drawn_r = None
+
+    def reset_page(self):
+        """Reset selection and page number."""
         self.sel = 0
         self.page = 0
-        if reset_cache:
-            self.sel_cache = 0
-            self.page_cache = 0
+
+    def get_pos(self):
+        """Returns the position of the selection in the data."""
+        return self.page * self.maxitems + self.sel
+
+    def set_pos(self, pos):
+        """Move the selection to a position in the data."""
+        if self.maxitems:
+            self.page, self.sel = divmod(pos, self.maxitems)
 
     def check_term_size(self):
         """Check if Terminal is too small to display content"""
@@ -274,6 +569,7 @@ class Interface:
 
     def warn_term_size(self):
         """Pop a warning if term is too small to display content."""
+        self.redraw_all()
         self.screen.clear()
         if self.size[0] > 2 and self.size[1] > 16:
             self.screen.addstr(0, 0, "Terminal")
@@ -287,14 +583,11 @@ class Interface:
         end = self.maxitems * (self.page + 1)
 
         if twitch.data:
-            if self.state == "top":
-                self.cur_page = twitch.data["top"][start:end]
-            elif self.state == "search" or self.state == "follow" and self.f_filter == "online":
-                self.cur_page = twitch.data["streams"][start:end]
-            elif self.state == "follow" and self.f_filter == "all":
-                self.cur_page = list(config.followed)[start:end]
-            elif self.state == "vods":
-                self.cur_page = twitch.data["videos"][start:end]
+            self.cur_page = twitch.items()[start:end]
+
+            # Ask for the next window of results once the last page is reached
+            if end >= twitch.results and not twitch.filter:
+                twitch.load_more()
         else:
             self.cur_page = []
 
@@ -304,6 +597,7 @@ class Interface:
         Used for searching for streams and game name.
         """
         win = curses.newwin(3, self.size[1] // 2 - 4, self.size[0] // 2 - 1, self.size[1] // 4)
+        self.redraw_all()
         win.border(0)
         win.addnstr(0, 3, text, self.size[0] - 4)
         win.refresh()
@@ -316,44 +610,96 @@ class Interface:
     def draw_win_l(self):
         """Display the left half of the screen.
         Left window is used for displaying Twitch data and making selections.
+        When only the selection moved, just the rows it moved between are repainted.
         """
+        status = []
+        if twitch.filter or self.filtering:
+            status.append(f"filter: {twitch.filter}" + ("_" if self.filtering else ""))
+        if twitch.sort != "default":
+            status.append(f"sort: {twitch.sort}")
+        if twitch.stale:
+            status.append("stale")
+        if twitch.pending:
+            status.append("loading...")
+        if twitch.importing:
+            fetched, total = twitch.imported
+            status.append(f"import: {fetched}/{'?' if total is None else total}")
+        elif twitch.import_notice:
+            status.append(twitch.import_notice)
+        if self.launcher.playing():
+            status.append(f"playing: {self.launcher.playing()}")
+
+        view = (self.state, self.f_filter, self.page, twitch.version, twitch.results, status)
+        if self.drawn_l and self.drawn_l[0] == view:
+            if self.drawn_l[1] != self.sel:
+                self.draw_row(self.drawn_l[1])
+                self.draw_row(self.sel)
+                self.drawn_l = (view, self.sel)
+                self.win_l.noutrefresh()
+            return
+        self.drawn_l = (view, self.sel)
+
         self.win_l.erase()
         if config.cp.getboolean("ui", "show_borders"):
             self.win_l.border(0)
-        index = 0
 
-        for i in self.cur_page:
-            if index >= self.maxitems:
-                break
-
-            if self.state == "top":
-                string = str(i["game"]["name"])
-            elif self.state == "vods":
-                string = str(i["title"]).replace("\n", "")
-                # truncate long vod titles
-                if len(string) > self.maxlen // 2:
-                    string = string[: self.maxlen // 2] + "..."
-                string += " - " + str(i["game"])
-            elif self.state == "search" or (self.state == "follow" and self.f_filter == "online"):
-                string = str(i["channel"]["display_name"])
-                if twitch.query[0] != "game":
-                    string += " - " + str(i["game"])
-            elif self.state == "follow" and self.f_filter == "all":
-                string = str(i)
-
-            if index == self.sel:
-                self.win_l.addnstr(
-                    index * 2 + 2, 2, string, self.maxlen, curses.A_UNDERLINE | self.hl_1,
-                )
-            else:
-                self.win_l.addnstr(index * 2 + 2, 2, string, self.maxlen, self.hl_3)
-            index += 1
+        for index in range(min(len(self.cur_page), self.maxitems)):
+            self.draw_row(index)
 
         self.win_l.addnstr(
             self.size[0] - 2, self.size[1] // 2 - 9, f" page:{self.page + 1}", self.maxlen,
         )
 
+        if status:
+            self.win_l.addnstr(
+                self.size[0] - 1, 2, f" {', '.join(status)} ", self.maxlen, self.hl_1
+            )
+
         self.draw_win_l_headers()
+        self.win_l.noutrefresh()
+
+    def row_label(self, i):
+        """Returns the text of an item's row in the left window.
+        Labels are made once per item, until the data, view or width changes."""
+        view = (twitch.version, self.state, self.f_filter, twitch.query[0], self.maxlen)
+        if view != self.labels_view:
+            self.labels = {}
+            self.labels_view = view
+
+        if i in self.labels:
+            return self.labels[i]
+
+        if self.state == "top":
+            string = i.name
+        elif self.state == "vods":
+            string = i.title.replace("\n", "")
+            # truncate long vod titles
+            if len(string) > self.maxlen // 2:
+                string = string[: self.maxlen // 2] + "..."
+            string += " - " + i.game
+        elif self.state == "search" or (self.state == "follow" and self.f_filter == "online"):
+            string = i.display_name
+            if twitch.query[0] != "game":
+                string += " - " + i.game
+        elif self.state == "follow" and self.f_filter == "all":
+            string = str(i)
+
+        self.labels[i] = string
+        return string
+
+    def draw_row(self, index):
+        """Paint a row of the left window over whatever it showed before."""
+        if index >= min(len(self.cur_page), self.maxitems):
+            return
+
+        string = self.row_label(self.cur_page[index])
+        self.win_l.addnstr(index * 2 + 2, 2, " " * self.maxlen, self.maxlen)
+        if index == self.sel:
+            self.win_l.addnstr(
+                index * 2 + 2, 2, string, self.maxlen, curses.A_UNDERLINE | self.hl_1,
+            )
+        else:
+            self.win_l.addnstr(index * 2 + 2, 2, string, self.maxlen, self.hl_3)
 
     def draw_win_l_headers(self):
         """Displays Headers in game view and vod view"""
@@ -368,16 +714,29 @@ class Interface:
             self.win_l.addnstr(1, self.size[1] // 2 - (t_len + 2), text, self.maxlen)
             self.win_l.hline(2, self.size[1] // 2 - (t_len + 2), curses.ACS_HLINE, t_len)
 
-        self.win_l.refresh()
-
     def draw_win_r(self):
         """Display right half of the screen.
         Right window is used for displaying additional info like descriptions.
+        Skipped if the selection and its info haven't changed, stats are always redrawn.
         """
+        selected = self.cur_page[self.sel] if self.sel < len(self.cur_page) else None
+        view = (
+            self.state, self.f_filter, selected, twitch.version, self.cur_quality,
+            self.launcher.version,
+        )
+        if not self.show_stats and self.drawn_r == view:
+            self.win_r.noutrefresh()
+            return
+        self.drawn_r = None if self.show_stats else view
+
         self.win_r.erase()
         if config.cp.getboolean("ui", "show_borders"):
             self.win_r.border(0)
         self.draw_keys()
+        if self.show_stats:
+            self.draw_stats()
+            self.win_r.noutrefresh()
+            return
         index = 0
 
         for i in self.cur_page:
@@ -388,98 +747,165 @@ class Interface:
                 index += 1
                 continue
 
-            if self.state == "top":
-                self.win_r.addnstr(2, 3, f"Viewers: {i['viewers']}", self.maxlen, self.hl_2)
-                self.win_r.addnstr(3, 3, f"Channels: {i['channels']}", self.maxlen, self.hl_2)
+            if self.state == "top" and i.viewers is not None:
+                self.win_r.addnstr(2, 3, f"Viewers: {i.viewers}", self.maxlen, self.hl_2)
+                self.win_r.addnstr(3, 3, f"Channels: {i.channels}", self.maxlen, self.hl_2)
             elif self.state == "vods":
-                m, s = divmod(i["length"], 60)
+                m, s = divmod(i.length, 60)
                 h, m = divmod(m, 60)
 
-                self.win_r.addnstr(2, 3, f"Date: {i['created_at']}", self.maxlen, self.hl_2)
-                self.win_r.addnstr(3, 3, f"Views: {i['views']}", self.maxlen, self.hl_2)
+                self.win_r.addnstr(2, 3, f"Date: {i.created_at}", self.maxlen, self.hl_2)
+                self.win_r.addnstr(3, 3, f"Views: {i.views}", self.maxlen, self.hl_2)
                 self.win_r.addnstr(4, 3, f"Length: {h:02}:{m:02}:{s:02}", self.maxlen, self.hl_2)
-                self.win_r.addnstr(5, 3, f"Status: {i['status']}", self.maxlen, self.hl_2)
+                self.win_r.addnstr(5, 3, f"Status: {i.status}", self.maxlen, self.hl_2)
+                self.draw_player(6, i.url)
             elif self.state == "search" or (self.state == "follow" and self.f_filter == "online"):
-                self.win_r.addnstr(
-                    self.size[0] - 3,
-                    2,
-                    "quality: " + config.cp["keys"]["qual-"] + config.cp["keys"]["qual+"],
-                    self.maxlen,
-                )
-                self.win_r.addnstr(
-                    self.size[0] - 2, 3, self.quality[self.cur_quality], self.maxlen
-                )
-                self.win_r.addnstr(2, 3, str(i["channel"]["url"]), self.maxlen, self.hl_2)
-                self.win_r.addnstr(
-                    4, 3, f"Language: {i['channel']['language']}", self.maxlen, self.hl_2,
-                )
-                self.win_r.addnstr(5, 3, f"Viewers: {i['viewers']}", self.maxlen, self.hl_2)
+                self.win_r.addnstr(self.size[0] - 3, 2, self.quality_help, self.maxlen)
+                self.win_r.addnstr(self.size[0] - 2, 3, self.quality_line(i.url), self.maxlen)
+                self.win_r.addnstr(2, 3, i.url, self.maxlen, self.hl_2)
+                self.draw_player(3, i.url)
+                self.win_r.addnstr(4, 3, f"Language: {i.language}", self.maxlen, self.hl_2)
+                self.win_r.addnstr(5, 3, f"Viewers: {i.viewers}", self.maxlen, self.hl_2)
                 self.win_r.addnstr(6, 3, "Status:", self.maxlen, self.hl_2)
-                status = wrap(str(i["channel"]["status"]), self.size[1] // 2 - 6)
+                status = self.wrap_status(i.status, self.size[1] // 2 - 6)
                 l_num = 7
                 for line in status:
                     if l_num >= self.size[0] - 4:
                         break
                     self.win_r.addstr(l_num, 4, line, self.hl_2)
                     l_num += 1
-                    # TODO Clean up
-                    # Lazy way of setting cursor position to display stderr
-                    # output from streamlink. A large enough error message
-                    # will vomit on the screen
-                self.win_r.addstr(l_num, 4, "", self.hl_2)
+                self.draw_player_output(l_num + 1, i.url)
             index += 1
 
-        self.win_r.refresh()
+        self.win_r.noutrefresh()
+
+    def qualities(self, url):
+        """Returns the qualities to pick from for url, streamlink's once they are listed."""
+        return self.launcher.qualities(url) or self.quality
+
+    def pick_quality(self, names):
+        """Returns the quality in names closest to the selected one.
+        That is itself, its 60fps variant, or best."""
+        for name in (self.cur_quality, f"{self.cur_quality}60"):
+            if name in names:
+                return name
+        return "best" if "best" in names else names[-1]
+
+    def quality_line(self, url):
+        """Returns the selected quality, among the stream's qualities once listed."""
+        names = self.launcher.qualities(url)
+        if not names:
+            return self.cur_quality
+
+        picked = self.pick_quality(names)
+        return " ".join(f"[{i}]" if i == picked else i for i in names)
+
+    def draw_player(self, l_num, url):
+        """Displays the state of the url's player, if it was launched."""
+        player = self.launcher.players.get(url)
+        if player:
+            self.win_r.addnstr(l_num, 3, f"Player: {player.describe()}", self.maxlen, self.hl_2)
+
+    def draw_player_output(self, l_num, url):
+        """Displays the last lines streamlink printed, if its player didn't start."""
+        player = self.launcher.players.get(url)
+        if not player or player.state == "playing":
+            return
 
-    def draw_keys(self):
-        """Displays keybinds for each page in the right hand window."""
-        if not config.cp.getboolean("ui", "show_keys"):
+        rows = self.size[0] - 4 - l_num
+        if rows <= 0:
             return
 
-        if self.state == "top":
-            items = [
-                f"back: {config.cp['keys']['back']}",
-                f"search: {config.cp['keys']['search']}",
-                f"followed: {config.cp['keys']['followed']}",
-                f"game: {config.cp['keys']['game']}",
-                f"top streams: {config.cp['keys']['t_stream']}",
-                f"refresh: {config.cp['keys']['refresh']}",
-                f"quit: {config.cp['keys']['quit']}",
-            ]
-        elif self.state in ("search", "vods"):
-            items = [
-                f"back: {config.cp['keys']['back']}",
-                f"search: {config.cp['keys']['search']}",
-                f"add follow: {config.cp['keys']['add']}",
-                f"chat: {config.cp['keys']['chat']}",
-                f"followed: {config.cp['keys']['followed']}",
-                f"game: {config.cp['keys']['game']}",
-                f"refresh: {config.cp['keys']['refresh']}",
-                f"top streams: {config.cp['keys']['t_stream']}",
-                f"top games: {config.cp['keys']['t_game']}",
-                f"vods: {config.cp['keys']['vods']}",
-                f"yank: {config.cp['keys']['yank']}",
-                f"quit: {config.cp['keys']['quit']}",
-            ]
-        elif self.state == "follow":
-            items = [
-                f"back: {config.cp['keys']['back']}",
-                f"search: {config.cp['keys']['search']}",
-                f"chat: {config.cp['keys']['chat']}",
-                f"delete: {config.cp['keys']['delete']}",
-                f"game: {config.cp['keys']['game']}",
-                f"import: {config.cp['keys']['import']}",
-                f"online/all: {config.cp['keys']['online']}",
-                f"refresh: {config.cp['keys']['refresh']}",
-                f"top streams: {config.cp['keys']['t_stream']}",
-                f"top games: {config.cp['keys']['t_game']}",
-                f"vods: {config.cp['keys']['vods']}",
-                f"yank: {config.cp['keys']['yank']}",
-                f"quit: {config.cp['keys']['quit']}",
-            ]
-        else:
-            items = []
+        for line in list(player.output)[-rows:]:
+            self.win_r.addnstr(l_num, 4, line, self.maxlen - 1)
+            l_num += 1
+
+    def wrap_status(self, text, width):
+        """Returns text wrapped to width. Cached, the same titles are shown over and over."""
+        key = (text, width)
+        if key not in self.wrap_cache:
+            if len(self.wrap_cache) >= 256:
+                self.wrap_cache.clear()
+            from textwrap import wrap
+
+            self.wrap_cache[key] = wrap(text, width)
+        return self.wrap_cache[key]
+
+    def draw_stats(self):
+        """Displays request and draw stats in place of the selection's info."""
+        for l_num, line in enumerate(twitch.stats.lines(), 2):
+            if l_num >= self.size[0] // 2:
+                break
+            self.win_r.addnstr(l_num, 3, line, self.maxlen, self.hl_2)
+
+    def build_key_help(self):
+        """Returns the keybinds shown in each state.
+        Built once, they only change with the config."""
+        if not config.cp.getboolean("ui", "show_keys"):
+            return {}
+
+        keys = config.cp["keys"]
+        return {
+            "top": [
+                f"back: {keys['back']}",
+                f"ahead: {keys['ahead']}",
+                f"search: {keys['search']}",
+                f"followed: {keys['followed']}",
+                f"filter: {keys['filter']}",
+                f"sort: {keys['sort']}",
+                f"game: {keys['game']}",
+                f"top streams: {keys['t_stream']}",
+                f"refresh: {keys['refresh']}",
+                f"stats: {keys['stats']}",
+                f"quit: {keys['quit']}",
+            ],
+            "search": [
+                f"back: {keys['back']}",
+                f"ahead: {keys['ahead']}",
+                f"search: {keys['search']}",
+                f"add follow: {keys['add']}",
+                f"chat: {keys['chat']}",
+                f"followed: {keys['followed']}",
+                f"filter: {keys['filter']}",
+                f"sort: {keys['sort']}",
+                f"game: {keys['game']}",
+                f"refresh: {keys['refresh']}",
+                f"replace: {keys['replace']}",
+                f"stop: {keys['stop']}",
+                f"top streams: {keys['t_stream']}",
+                f"top games: {keys['t_game']}",
+                f"vods: {keys['vods']}",
+                f"yank: {keys['yank']}",
+                f"stats: {keys['stats']}",
+                f"quit: {keys['quit']}",
+            ],
+            "follow": [
+                f"back: {keys['back']}",
+                f"ahead: {keys['ahead']}",
+                f"search: {keys['search']}",
+                f"chat: {keys['chat']}",
+                f"delete: {keys['delete']}",
+                f"filter: {keys['filter']}",
+                f"sort: {keys['sort']}",
+                f"game: {keys['game']}",
+                f"import: {keys['import']}",
+                f"online/all: {keys['online']}",
+                f"refresh: {keys['refresh']}",
+                f"replace: {keys['replace']}",
+                f"stop: {keys['stop']}",
+                f"top streams: {keys['t_stream']}",
+                f"top games: {keys['t_game']}",
+                f"vods: {keys['vods']}",
+                f"yank: {keys['yank']}",
+                f"stats: {keys['stats']}",
+                f"quit: {keys['quit']}",
+            ],
+        }
 
+    def draw_keys(self):
+        """Displays keybinds for each page in the right hand window."""
+        state = "search" if self.state == "vods" else self.state
+        items = self.key_help.get(state, [])
         length = len(items)
 
         # only draw keys if it takes up less than half the vertical space
@@ -491,6 +917,225 @@ class Interface:
                 length -= 1
 
 
+class Player:
+    """A launched streamlink process, and the last lines it printed."""
+
+    __slots__ = ("url", "process", "log", "read", "output", "state")
+
+    def __init__(self, url, process, log):
+        self.url = url
+        self.process = process
+        self.log = log
+        self.read = 0
+        self.output = deque(maxlen=20)
+        self.state = "starting"
+
+    def describe(self):
+        """Returns the state, with the exit code once exited."""
+        if self.state == "exited" and self.process:
+            return f"exited ({self.process.returncode})"
+        return self.state
+
+
+class Launcher:
+    """Starts streamlink for streams and vods, keeping track of each one by url.
+
+    Each player goes from starting to playing once streamlink starts the player,
+    then to exited. Output goes to an unnamed temp file instead of the screen, so it
+    can't draw over the TUI and streamlink keeps running after quitting.
+    """
+
+    def __init__(self):
+        self.max_streams = config.cp.getint("exec", "max_streams")
+        self.players = OrderedDict()
+        self.version = 0
+
+        # streamlink --json runs listing each stream's qualities, and their results by url
+        self.list_qualities = config.cp.getboolean("exec", "list_qualities")
+        self.listing = {}
+        self.manifests = Cache(64)
+        self.selected = (None, 0)
+
+    def playing(self):
+        """Returns the number of players that haven't exited."""
+        return sum(1 for i in self.players.values() if i.state in ("starting", "playing"))
+
+    def launch(self, url, cmd, replace=False):
+        """Run cmd for url, unless it is already playing.
+        replace stops the last player started first, otherwise nothing is launched
+        while max_streams are playing."""
+        player = self.players.get(url)
+        if player and player.state in ("starting", "playing"):
+            return
+
+        running = [i for i in self.players.values() if i.state in ("starting", "playing")]
+        if replace and running:
+            self.stop(running[-1].url)
+        elif self.max_streams and len(running) >= self.max_streams:
+            self.refuse(url, f"max_streams ({self.max_streams}) playing, stop or replace one")
+            return
+
+        from tempfile import TemporaryFile
+
+        log = TemporaryFile()
+        try:
+            process = Popen(
+                cmd, stdin=DEVNULL, stdout=log, stderr=STDOUT, start_new_session=True
+            )
+        except OSError as err:
+            log.close()
+            self.refuse(url, f"Could not start {cmd[0]}: {err.strerror}")
+            return
+
+        self.players.pop(url, None)
+        self.players[url] = Player(url, process, log)
+        self.changed()
+
+        # Forget the oldest exited players
+        for old in [i for i in self.players.values() if i.state == "exited"][:-10]:
+            del self.players[old.url]
+
+    def refuse(self, url, reason):
+        """Keep a player that didn't launch, with reason as its output."""
+        player = Player(url, None, None)
+        player.state = "not started"
+        player.output.append(reason)
+        self.players.pop(url, None)
+        self.players[url] = player
+        self.changed()
+
+    def stop(self, url):
+        """Terminate the url's player, and everything it started."""
+        player = self.players.get(url)
+        if player and player.state in ("starting", "playing"):
+            try:
+                killpg(player.process.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def poll(self):
+        """Read new output, check for exited players and listed qualities.
+        Returns True if any player changed."""
+        version = self.version
+        self.read_manifests()
+        for player in self.players.values():
+            if player.state not in ("starting", "playing"):
+                continue
+
+            # pread leaves the offset streamlink is writing at alone
+            data = pread(player.log.fileno(), 65536, player.read)
+            if data:
+                player.read += len(data)
+                text = data.decode("utf-8", "replace")
+                player.output.extend(i for i in text.splitlines() if i.strip())
+                if player.state == "starting" and "Starting player" in text:
+                    player.state = "playing"
+                self.changed()
+
+            if player.process.poll() is not None and len(data) < 65536:
+                player.state = "exited"
+                player.log.close()
+                self.changed()
+
+        return version != self.version
+
+    def changed(self):
+        """Count a change, so the players are redrawn."""
+        self.version += 1
+
+    def qualities(self, url):
+        """Returns the qualities streamlink listed for url, lowest first,
+        or None if they weren't listed yet."""
+        cached = self.manifests.get(url)
+        return cached[0] if cached else None
+
+    def prefetch(self, url):
+        """List the qualities of url in the background,
+        once it has been selected for PREFETCH_DELAY.
+        Listings for a previous selection are stopped, so only one runs at a time."""
+        if not self.list_qualities:
+            return
+
+        if url != self.selected[0]:
+            self.selected = (url, monotonic())
+            self.stop_listing(keep=url)
+            return
+        if not url:
+            return
+
+        cached = self.manifests.get(url)
+        if monotonic() - self.selected[1] < PREFETCH_DELAY or url in self.listing:
+            return
+        if cached and cached[1]:
+            return
+
+        cmd = shlex.split(config.cp["exec"]["streamlink"]) + [
+            "--http-header",
+            f"Client-ID={config.cp['twitch']['client_id']}",
+            "--json",
+            url,
+        ]
+        from tempfile import TemporaryFile
+
+        log = TemporaryFile()
+        try:
+            process = Popen(cmd, stdin=DEVNULL, stdout=log, stderr=DEVNULL)
+        except OSError:
+            log.close()
+            self.list_qualities = False  # No streamlink, stick to the fixed qualities
+            return
+        self.listing[url] = (process, log)
+
+    def read_manifests(self):
+        """Cache the qualities of finished streamlink --json runs.
+        Streams without any, like offline ones, are cached as an empty list.
+        Output that isn't json, e.g. from a streamlink without --json, turns listing off."""
+        for url, (process, log) in list(self.listing.items()):
+            if process.poll() is None:
+                continue
+
+            del self.listing[url]
+            log.seek(0)
+            try:
+                manifest = json.loads(log.read())
+            except ValueError:
+                manifest = None
+            finally:
+                log.close()
+
+            if not isinstance(manifest, dict):
+                self.list_qualities = False  # Stick to the fixed qualities
+                self.manifests.put(url, [], QUALITY_TTL)
+                continue
+
+            streams = manifest.get("streams") or {}
+            self.manifests.put(url, self.sort_qualities(streams), QUALITY_TTL)
+            self.changed()
+
+    def sort_qualities(self, names):
+        """Returns the quality names from lowest to highest, ending with best.
+        worst and best are aliases, only best is kept to jump to the top."""
+        def height(name):
+            match = re.match(r"(\d+)p(\d*)", name)
+            return (int(match[1]), int(match[2] or 30)) if match else (0, 0)
+
+        names = sorted((i for i in names if i not in ("worst", "best")), key=height)
+        return names + ["best"] if names else []
+
+    def stop_listing(self, keep=None):
+        """Stop the streamlink runs listing qualities, except the one for keep."""
+        for url, (process, log) in list(self.listing.items()):
+            if url != keep:
+                process.kill()
+                process.wait()
+                log.close()
+                del self.listing[url]
+
+    def close(self):
+        """Stop the streamlink runs still listing qualities, players are left running."""
+        self.stop_listing()
+
+
 class Keybinds:
     """User input and what to do with pressed keys."""
 
@@ -500,10 +1145,13 @@ class Keybinds:
         self.quality = self.Quality()
         self.follow = self.Follow()
         self.request = self.Request()
+        self.filter = self.Filter()
+        self.launch = self.Launch()
         self.misc = self.Misc()
 
         self.keybinds = {
             config.cp["keys"]["back"]: self.nav.back,
+            config.cp["keys"]["ahead"]: self.nav.ahead,
             config.cp["keys"]["down"]: self.nav.down,
             config.cp["keys"]["forward"]: self.nav.forward,
             config.cp["keys"]["page+"]: self.nav.page_next,
@@ -525,14 +1173,31 @@ class Keybinds:
             config.cp["keys"]["t_game"]: self.request.top_games_view,
             config.cp["keys"]["t_stream"]: self.request.top_streams_view,
             config.cp["keys"]["vods"]: self.request.vods_view,
+            config.cp["keys"]["filter"]: self.filter.start,
+            config.cp["keys"]["sort"]: self.filter.sort,
+            config.cp["keys"]["replace"]: self.launch.replace,
+            config.cp["keys"]["stop"]: self.launch.stop,
             config.cp["keys"]["chat"]: self.misc.exec_chat,
+            config.cp["keys"]["stats"]: self.misc.toggle_stats,
             config.cp["keys"]["yank"]: self.misc.exec_yank,
             chr(curses.KEY_RESIZE): self.misc.resize,
         }
 
     def input(self):
         """Gets the pressed key, then calls the respective function."""
-        self.cur_key = chr(ui.screen.getch())
+        key = ui.screen.getch()
+
+        # Timed out waiting for a key, check back on pending requests
+        if key == -1:
+            ui.donothing = True
+            return
+
+        # Keys typed into the filter don't count as commands, resizing still has to be handled
+        if ui.filtering and key != curses.KEY_RESIZE:
+            self.filter.edit(key)
+            return
+
+        self.cur_key = chr(key)
 
         # Disable input while term is too small
         if ui.check_term_size() and self.cur_key != chr(curses.KEY_RESIZE):
@@ -569,44 +1234,25 @@ class Keybinds:
             if not ui.cur_page:
                 return
 
-            if ui.state in ("search", "vods") or (
-                ui.state == "follow" and ui.f_filter == "online"
-            ):
+            url = user_input.launch.selected()
+            if url:
                 ui.win_blink()
-                if ui.state != "vods":
-                    url = ui.cur_page[ui.sel]["channel"]["url"]
-                else:
-                    url = ui.cur_page[ui.sel]["url"]
-
-                # streamlink expects the player to be a single quoted arg
-                # change single quotes so they don't break shlex's splitting
-                player = config.cp["exec"]["player"].replace("'", '"')
-                quality = ui.quality[ui.cur_quality]
-
-                # prefer 60fps streams, but fallback if they aren't available
-                if quality[-1] == 'p':
-                    quality = f"{quality}60,{quality}"
-
-                cmd = (
-                    f"setsid "  # detach process from terminal
-                    f"{config.cp['exec']['streamlink']} -Q "
-                    f"--http-header Client-ID={config.cp['twitch']['client_id']} "
-                    f"-p '{player}' "
-                    f"{url} {quality}"
-                )
-
-                Popen(shlex.split(cmd))
+                ui.launcher.launch(url, user_input.launch.command(url))
 
             elif ui.state == "top":
-                twitch.request(["game", ui.cur_page[ui.sel]["game"]["name"]], "search")
+                twitch.request(["game", ui.cur_page[ui.sel].name], "search")
 
         def back(self):
-            """Go to cached page"""
-            ui.state = twitch.state_cache
-            twitch.data = twitch.cache
-            twitch.set_results()
-            ui.sel = ui.sel_cache
-            ui.page = ui.page_cache
+            """Go to previous page in history"""
+            frame = twitch.history.back(ui.get_pos())
+            if frame:
+                twitch.restore(frame)
+
+        def ahead(self):
+            """Go to next page in history"""
+            frame = twitch.history.ahead(ui.get_pos())
+            if frame:
+                twitch.restore(frame)
 
         def page_next(self):
             """Go to next page"""
@@ -625,13 +1271,18 @@ class Keybinds:
 
         def qual_next(self):
             """Select next highest quality"""
-            if ui.cur_quality < len(ui.quality) - 1:
-                ui.cur_quality += 1
+            self.step(1)
 
         def qual_prev(self):
             """Select next lowest quality"""
-            if ui.cur_quality > 0:
-                ui.cur_quality -= 1
+            self.step(-1)
+
+        def step(self, offset):
+            """Select the quality offset from the current one, among the selected stream's"""
+            names = ui.qualities(user_input.launch.selected())
+            pos = names.index(ui.pick_quality(names)) + offset
+            if 0 <= pos < len(names):
+                ui.cur_quality = names[pos]
 
     class Follow:
         """Keys used to visit or interact with followed channels."""
@@ -642,7 +1293,7 @@ class Keybinds:
             if (user_input.cur_key == config.cp["keys"]["followed"] and ui.state != "follow") or (
                 user_input.cur_key == config.cp["keys"]["online"] and ui.state == "follow" and ui.f_filter == "all"
             ):
-                twitch.request(["channel", ",".join(config.followed.values())], "follow")
+                twitch.request(["channel", config.followed_ids()], "follow")
                 ui.f_filter = "online"
             elif (user_input.cur_key == config.cp["keys"]["online"] and ui.state == "follow" and ui.f_filter == "online"):
                 ui.f_filter = "all"
@@ -655,11 +1306,9 @@ class Keybinds:
                 return
 
             if ui.state == "search":
-                if ui.cur_page[ui.sel]["channel"]["name"] not in config.followed:
+                if ui.cur_page[ui.sel].name not in config.followed:
                     ui.win_blink()
-                    config.followed[ui.cur_page[ui.sel]["channel"]["name"]] = str(
-                        ui.cur_page[ui.sel]["channel"]["_id"]
-                    )
+                    config.followed[ui.cur_page[ui.sel].name] = ui.cur_page[ui.sel].channel_id
             elif ui.state == "follow" and ui.f_filter != "all":
                 ui.f_filter = "all"
                 ui.reset_page()
@@ -674,9 +1323,10 @@ class Keybinds:
                 if ui.cur_page:
                     del config.followed[ui.cur_page[ui.sel]]
             elif ui.f_filter == "online":
-                if ui.cur_page:
-                    del config.followed[ui.cur_page[ui.sel]["channel"]["name"]]
-                    twitch.query = ["channel", ",".join(config.followed.values())]
+                name = ui.cur_page and config.followed.name_of(ui.cur_page[ui.sel].channel_id)
+                if name:
+                    del config.followed[name]
+                    twitch.query = ["channel", config.followed_ids()]
                     user_input.request.refresh()
 
         def user_import(self):
@@ -687,10 +1337,10 @@ class Keybinds:
             overwrite = False
             user = ui.prompt("Import from user")
 
-            if user:
-                config.import_follows_from_user(user, overwrite)
-                twitch.query = ["channel", ",".join(config.followed.values())]
-                user_input.request.refresh()
+            if not user:
+                return
+
+            twitch.import_follows(user.decode("utf-8"), overwrite)
 
     class Request:
         """Keys used to query twitch"""
@@ -711,7 +1361,7 @@ class Keybinds:
             if ui.state == "follow" and ui.f_filter == "all":
                 twitch.request(["vods", str(config.followed[ui.cur_page[ui.sel]])], "vods")
             else:
-                twitch.request(["vods", str(ui.cur_page[ui.sel]["channel"]["_id"])], "vods")
+                twitch.request(["vods", ui.cur_page[ui.sel].channel_id], "vods")
 
         def game_search(self):
             """Search by game name (exact match)"""
@@ -727,13 +1377,93 @@ class Keybinds:
 
         def refresh(self):
             """Resend last request and reload results"""
-            twitch.request()
+            twitch.request(on_done=self.refreshed, use_cache=False)
+
+        def refreshed(self):
+            """Reload results once a refresh finishes"""
             twitch.set_results()
-            if twitch.data:
-                if ui.state == twitch.state_cache:
-                    twitch.cache = twitch.data
-                if ui.sel >= twitch.results:
-                    ui.sel = 0
+            if twitch.data and ui.get_pos() >= twitch.results:
+                ui.reset_page()
+
+    class Filter:
+        """Keys used to filter and sort the shown results, without querying twitch again."""
+
+        def start(self):
+            """Start typing a filter"""
+            ui.filtering = True
+
+        def edit(self, key):
+            """Change the filter with a typed key.
+            Enter keeps the filter, escape clears it."""
+            if key in (10, 13, curses.KEY_ENTER):
+                ui.filtering = False
+            elif key == 27:
+                twitch.filter = ""
+                ui.filtering = False
+            elif key in (8, 127, curses.KEY_BACKSPACE):
+                twitch.filter = twitch.filter[:-1]
+            elif 32 <= key < 127:
+                twitch.filter += chr(key)
+            else:
+                ui.donothing = True
+                return
+            ui.reset_page()
+
+        def sort(self):
+            """Sort the shown results by the next order in SORTS"""
+            twitch.sort = SORTS[(SORTS.index(twitch.sort) + 1) % len(SORTS)]
+            ui.reset_page()
+
+    class Launch:
+        """Keys used to manage launched streams."""
+
+        def selected(self):
+            """Returns the url of the selected stream or vod, or None"""
+            if not ui.cur_page or ui.sel >= len(ui.cur_page):
+                return None
+            if ui.state in ("search", "vods") or (
+                ui.state == "follow" and ui.f_filter == "online"
+            ):
+                # The page can still hold the previous view's items while a request is pending
+                return getattr(ui.cur_page[ui.sel], "url", None)
+            return None
+
+        def command(self, url):
+            """Returns the streamlink command for url at the selected quality"""
+            # streamlink expects the player to be a single quoted arg
+            # change single quotes so they don't break shlex's splitting
+            player = config.cp["exec"]["player"].replace("'", '"')
+            names = ui.launcher.qualities(url)
+
+            if names:
+                # Listed by streamlink, so ask for the exact one
+                quality = ui.pick_quality(names)
+            else:
+                quality = ui.cur_quality
+                # prefer 60fps streams, but fallback if they aren't available
+                if quality[-1] == 'p':
+                    quality = f"{quality}60,{quality}"
+
+            cmd = (
+                f"{config.cp['exec']['streamlink']} "
+                f"--http-header Client-ID={config.cp['twitch']['client_id']} "
+                f"-p '{player}' "
+                f"{url} {quality}"
+            )
+            return shlex.split(cmd)
+
+        def replace(self):
+            """Launch the selected stream, stopping the last one started"""
+            url = self.selected()
+            if url:
+                ui.win_blink()
+                ui.launcher.launch(url, self.command(url), replace=True)
+
+        def stop(self):
+            """Stop the selected stream's player"""
+            url = self.selected()
+            if url:
+                ui.launcher.stop(url)
 
     class Misc:
         """Keys that don't fit into the other categories."""
@@ -741,7 +1471,11 @@ class Keybinds:
         def resize(self):
             """Reset the screen when the terminal is resized"""
             ui.init_screen()
-            ui.reset_page(True)
+            ui.reset_page()
+
+        def toggle_stats(self):
+            """Show/hide request and draw stats"""
+            ui.show_stats = not ui.show_stats
 
         def exec_yank(self):
             """Yank channel url to clipboard"""
@@ -751,7 +1485,7 @@ class Keybinds:
             ui.win_blink()
             if (ui.state == "search") or (ui.state == "follow" and ui.f_filter == "online"):
                 clip = Popen(["xclip", "-selection", "c"], stdin=PIPE)
-                clip.communicate(input=bytes(ui.cur_page[ui.sel]["channel"]["url"], "utf-8"))
+                clip.communicate(input=bytes(ui.cur_page[ui.sel].url, "utf-8"))
 
         def exec_chat(self):
             """Open chat with chat_method"""
@@ -761,7 +1495,7 @@ class Keybinds:
             if config.cp["exec"]["chat_method"] == "browser":
                 cmd = (
                     f"{config.cp['exec']['browser']} "
-                    f"https://twitch.tv/popout/{ui.cur_page[ui.sel]['channel']['name']}/chat"
+                    f"https://twitch.tv/popout/{ui.cur_page[ui.sel].name}/chat"
                 )
 
                 Popen(shlex.split(cmd), stdout=DEVNULL, stderr=DEVNULL)
@@ -791,7 +1525,7 @@ class Keybinds:
                     # It will overwrite the saved setting for the network
                     # TODO Alternatives for cleaner joining?
                     f"/set irc.server.{network}.autojoin "
-                    f"#{ui.cur_page[ui.sel]['channel']['name']};"
+                    f"#{ui.cur_page[ui.sel].name};"
                     f"/connect {network}'"
                 )
 
@@ -807,124 +1541,1677 @@ class Keybinds:
 
                 clip = Popen(["xclip", "-selection", "c"], stdin=PIPE)
                 clip.communicate(
-                    input=bytes("/join #" + ui.cur_page[ui.sel]["channel"]["name"], "utf-8")
+                    input=bytes("/join #" + ui.cur_page[ui.sel].name, "utf-8")
                 )
 
 
+class Record:
+    """Base for the records api results are stored as, only keeps the fields in __slots__."""
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+    def as_dict(self):
+        """Returns the record's fields as a dict."""
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class Game(Record):
+    """A game in the top games list."""
+
+    __slots__ = ("name", "viewers", "channels")
+
+
+class Stream(Record):
+    """A live stream."""
+
+    __slots__ = (
+        "name",
+        "display_name",
+        "channel_id",
+        "url",
+        "game",
+        "viewers",
+        "status",
+        "language",
+        "started_at",
+    )
+
+
+class Vod(Record):
+    """A past broadcast or upload of a channel."""
+
+    __slots__ = (
+        "name",
+        "channel_id",
+        "title",
+        "url",
+        "game",
+        "views",
+        "length",
+        "created_at",
+        "status",
+    )
+
+
+# Record type of each list of results in a response
+RECORD_TYPES = {"top": Game, "streams": Stream, "videos": Vod}
+
+
+class Api:
+    """Base for the supported twitch api versions.
+    Turns [type, argument] queries into urls, and responses into records.
+    Results keep the same layout for every api: a dict with "_total",
+    and the records under "top", "streams" or "videos".
+    """
+
+    base_url = ""
+
+    def __init__(self, twitch):
+        self.twitch = twitch
+        self.limit = twitch.results_limit
+        if config.cp["twitch"]["api_url"]:
+            self.base_url = config.cp["twitch"]["api_url"].rstrip("/") + "/"
+
+    def headers(self):
+        """Headers sent with every request."""
+        return {"Client-ID": config.cp["twitch"]["client_id"]}
+
+    def url(self, req, page=None):
+        """Returns the url for a query, argument must be quoted.
+        page selects the page of paginated queries."""
+        raise NotImplementedError
+
+    def results(self, query, url, cancel=None):
+        """Fetch the results for a prepared query, as records. None on failure.
+        "_next" holds the url of the next window of results, or None if there are no more.
+        """
+        raise NotImplementedError
+
+    def parse(self, kind, data, url):
+        """Turn a response for a query type into records, url is the one fetched."""
+        raise NotImplementedError
+
+    def url_class(self, url):
+        """Group urls by endpoint for the stats, e.g. channels/_/videos.
+        IDs in the path are replaced by _, the query string is dropped."""
+        endpoint = url[len(self.base_url) :] if url.startswith(self.base_url) else url
+        segments = endpoint.split("?")[0].strip("/").split("/")
+        return "/".join("_" if i.isdigit() else i for i in segments)
+
+    def more(self, query, url, cancel=None):
+        """Fetch the next window of results from a "_next" url, as records."""
+        data = self.twitch.fetch(url, cancel)
+        if data is None:
+            return None
+        return self.parse(query[0], data, url)
+
+    def page_url(self, url, param, value):
+        """Returns the url with its paging parameter set to value."""
+        return re.sub(rf"&{param}=[^&]*", "", url) + f"&{param}={value}"
+
+    def ids(self, names):
+        """Looks up channel names in batches.
+        Returns a dict of lowercase name: ID, with None for unknown channels.
+        Names in a batch that failed to fetch are left out.
+        """
+        raise NotImplementedError
+
+    def follows(self, user_id):
+        """Yields ([(name, ID), ...], total) for each page of the channels a user follows.
+        Pages that fail are skipped."""
+        raise NotImplementedError
+
+    def streams(self, data):
+        """Returns the stream records in a streams response."""
+        raise NotImplementedError
+
+    def channels(self, ids, cancel=None):
+        """Query the online streams for a list of channel IDs.
+        IDs are split into chunks of results_limit and fetched in parallel,
+        the streams are then merged and sorted by viewers like a single query.
+        Returns None if any chunk fails.
+        """
+        ids = [api_id for api_id in ids if api_id]
+        urls = [
+            self.url(["channel", ",".join(ids[start : start + self.limit])])
+            for start in range(0, len(ids), self.limit)
+        ]
+
+        pages = self.twitch.fetch_all(urls, cancel)
+        if pages is None:
+            return None
+
+        streams = [stream for data in pages for stream in self.streams(data)]
+        streams.sort(key=lambda i: i.viewers, reverse=True)
+        return {"_total": len(streams), "streams": streams, "_next": None}
+
+
+class Kraken(Api):
+    """Twitch's v5 api."""
+
+    base_url = "https://api.twitch.tv/kraken/"
+
+    def headers(self):
+        """Headers sent with every request."""
+        headers = super().headers()
+        headers["Accept"] = "application/vnd.twitchtv.v5+json"
+        return headers
+
+    def url(self, req, page=None):
+        """Returns the url for a query, argument must be quoted.
+        page is the offset of paginated queries."""
+        url = self.base_url
+
+        if req[0] == "topgames":
+            url += f"games/top?limit={self.limit}"
+        elif req[0] == "topstreams":
+            url += f"streams?limit={self.limit}"
+        elif req[0] == "game":
+            url += f"streams?limit={self.limit}&game={req[1]}"
+            if config.cp["twitch"]["lang"] != "":
+                url += f"&language={config.cp['twitch']['lang']}"
+        elif req[0] == "channel":
+            # Every followed channel could be live, so ask for all of them
+            url += f"streams/?channel={req[1]}&limit={len(unquote(req[1]).split(','))}"
+        elif req[0] == "stream":
+            url += f"search/streams?limit={self.limit}&query={req[1]}"
+        elif req[0] == "vods":
+            url += f"channels/{req[1]}/videos?limit={self.limit}"
+        elif req[0] == "get_id":
+            url += f"users?login={req[1]}"
+        elif req[0] == "get_follows":
+            url += f"users/{req[1]}/follows/channels?limit={self.limit}"
+        else:
+            raise ValueError("Invalid Type Passed")
+
+        if page:
+            url += f"&offset={page}"
+
+        return url
+
+    def results(self, query, url, cancel=None):
+        """Fetch the results for a prepared query, as records. None on failure."""
+        if query[0] == "channel":
+            return self.channels(unquote(query[1]).split(","), cancel)
+
+        data = self.twitch.fetch(url, cancel)
+        if data is None:
+            return None
+        return self.parse(query[0], data, url)
+
+    def parse(self, kind, data, url):
+        """Turn a response for a query type into records, url is the one fetched."""
+        if kind == "topgames":
+            records = {"top": [self.game(i) for i in data["top"]]}
+        elif kind == "vods":
+            records = {"videos": [self.vod(i) for i in data["videos"]]}
+        else:
+            records = {"streams": self.streams(data)}
+
+        count = len(next(iter(records.values())))
+        offset = re.search(r"&offset=(\d+)", url)
+        offset = int(offset.group(1)) + count if offset else count
+
+        records["_total"] = data["_total"]
+        records["_next"] = None
+        if count and offset < data["_total"]:
+            records["_next"] = self.page_url(url, "offset", offset)
+        return records
+
+    def ids(self, names):
+        """Looks up channel names in batches.
+        Returns a dict of lowercase name: ID, with None for unknown channels.
+        Names in a batch that failed to fetch are left out.
+        """
+        ids = {}
+        for start in range(0, len(names), ID_BATCH_SIZE):
+            batch = [name.lower() for name in names[start : start + ID_BATCH_SIZE]]
+            data = self.twitch.fetch(self.url(["get_id", quote(",".join(batch), safe=",")]))
+            if not data:
+                continue
+
+            found = {user["name"]: str(user["_id"]) for user in data["users"]}
+            for name in batch:
+                ids[name] = found.get(name)
+
+        return ids
+
+    def follows(self, user_id):
+        """Yields ([(name, ID), ...], total) for each page of the channels a user follows.
+        The first page gives the total, the rest are fetched in parallel
+        and yielded in the order they arrive. Pages that fail are skipped.
+        """
+        data = self.twitch.fetch(self.url(["get_follows", user_id]))
+        if data is None:
+            return
+
+        total = data["_total"]
+        yield self.follow_page(data), total
+
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+
+        offsets = range(self.limit, total, self.limit)
+        with ThreadPoolExecutor(self.twitch.pool_size) as pool:
+            pages = [
+                pool.submit(
+                    self.twitch.limits.bind(self.twitch.fetch),
+                    self.url(["get_follows", user_id], offset),
+                )
+                for offset in offsets
+            ]
+            for page in as_completed(pages):
+                data = page.result()
+                if data:
+                    yield self.follow_page(data), total
+
+    def follow_page(self, data):
+        """Returns the (name, ID) of each channel in a page of follows."""
+        return [(i["channel"]["name"], str(i["channel"]["_id"])) for i in data["follows"]]
+
+    def streams(self, data):
+        """Returns the stream records in a streams response."""
+        return [
+            Stream(
+                name=i["channel"]["name"],
+                display_name=str(i["channel"]["display_name"]),
+                channel_id=str(i["channel"]["_id"]),
+                url=str(i["channel"]["url"]),
+                game=str(i["game"]),
+                viewers=i["viewers"],
+                status=str(i["channel"]["status"]),
+                language=i["channel"]["language"],
+                started_at=i.get("created_at"),
+            )
+            for i in data["streams"]
+        ]
+
+    def game(self, item):
+        """Create a record from a games/top result"""
+        return Game(
+            name=str(item["game"]["name"]), viewers=item["viewers"], channels=item["channels"]
+        )
+
+    def vod(self, item):
+        """Create a record from a channels/videos result"""
+        return Vod(
+            name=item["channel"]["name"],
+            channel_id=str(item["channel"]["_id"]),
+            title=str(item["title"]),
+            url=str(item["url"]),
+            game=str(item["game"]),
+            views=item["views"],
+            length=item["length"],
+            created_at=item["created_at"],
+            status=item["status"],
+        )
+
+
+class Helix(Api):
+    """Twitch's new api, requires an OAuth token.
+    Lists are paginated with cursors, and some queries take two requests,
+    e.g. game names have to be looked up to get the game's ID.
+    Viewer and channel counts aren't available for top games.
+    """
+
+    base_url = "https://api.twitch.tv/helix/"
+
+    def headers(self):
+        """Headers sent with every request."""
+        headers = super().headers()
+        if config.cp["twitch"]["token"]:
+            headers["Authorization"] = f"Bearer {config.cp['twitch']['token']}"
+        return headers
+
+    def url(self, req, page=None):
+        """Returns the url for a query, argument must be quoted.
+        page is the cursor of paginated queries."""
+        url = self.base_url
+        # Helix pages are capped at 100 results
+        limit = min(self.limit, 100)
+
+        if req[0] == "topgames":
+            url += f"games/top?first={limit}"
+        elif req[0] == "topstreams" or (req[0] == "stream" and not unquote(req[1]).strip()):
+            url += f"streams?first={limit}"
+        elif req[0] == "game":
+            # The game's ID has to be looked up first, see results()
+            url += f"games?name={req[1]}"
+        elif req[0] == "game_id":
+            url += f"streams?first={limit}&game_id={req[1]}"
+            if config.cp["twitch"]["lang"] != "":
+                url += f"&language={config.cp['twitch']['lang']}"
+        elif req[0] == "channel":
+            ids = unquote(req[1]).split(",")
+            url += f"streams?first={len(ids)}&" + "&".join(f"user_id={i}" for i in ids)
+        elif req[0] == "stream":
+            url += f"search/channels?first={limit}&live_only=true&query={req[1]}"
+        elif req[0] == "vods":
+            url += f"videos?first={limit}&user_id={req[1]}"
+        elif req[0] == "get_id":
+            url += "users?" + "&".join(f"login={i}" for i in unquote(req[1]).split(","))
+        elif req[0] == "get_follows":
+            url += f"users/follows?first=100&from_id={req[1]}"
+        else:
+            raise ValueError("Invalid Type Passed")
+
+        if page:
+            url += f"&after={page}"
+
+        return url
+
+    def results(self, query, url, cancel=None):
+        """Fetch the results for a prepared query, as records. None on failure."""
+        if query[0] == "channel":
+            return self.channels(unquote(query[1]).split(","), cancel)
+
+        data = self.twitch.fetch(url, cancel)
+        if data is None:
+            return None
+
+        if query[0] == "game":
+            if not data["data"]:
+                return {"_total": 0, "streams": [], "_next": None}
+            url = self.url(["game_id", data["data"][0]["id"]])
+            data = self.twitch.fetch(url, cancel)
+            if data is None:
+                return None
+        elif query[0] == "stream" and "search/" in url:
+            # Search results lack viewer counts, get the streams themselves
+            return self.channels([str(i["id"]) for i in data["data"]], cancel)
+
+        return self.parse(query[0], data, url)
+
+    def parse(self, kind, data, url):
+        """Turn a response for a query type into records, url is the one fetched."""
+        if kind == "topgames":
+            games = [Game(name=i["name"], viewers=None, channels=None) for i in data["data"]]
+            records = {"top": games}
+        elif kind == "vods":
+            records = {"videos": [self.vod(i) for i in data["data"]]}
+        else:
+            records = {"streams": self.streams(data)}
+
+        cursor = data.get("pagination", {}).get("cursor")
+        records["_total"] = len(data["data"])
+        records["_next"] = None
+        if cursor and data["data"]:
+            records["_next"] = self.page_url(url, "after", cursor)
+        return records
+
+    def ids(self, names):
+        """Looks up channel names in batches.
+        Returns a dict of lowercase name: ID, with None for unknown channels.
+        Names in a batch that failed to fetch are left out.
+        """
+        ids = {}
+        for start in range(0, len(names), ID_BATCH_SIZE):
+            batch = [name.lower() for name in names[start : start + ID_BATCH_SIZE]]
+            data = self.twitch.fetch(self.url(["get_id", quote(",".join(batch), safe=",")]))
+            if not data:
+                continue
+
+            found = {user["login"]: str(user["id"]) for user in data["data"]}
+            for name in batch:
+                ids[name] = found.get(name)
+
+        return ids
+
+    def follows(self, user_id):
+        """Yields ([(name, ID), ...], total) for each page of the channels a user follows.
+        Each page holds the cursor to the next, so they are fetched one at a time.
+        """
+        cursor = None
+        while True:
+            data = self.twitch.fetch(self.url(["get_follows", user_id], cursor))
+            if not data:
+                return
+
+            yield [(i["to_login"], str(i["to_id"])) for i in data["data"]], data["total"]
+
+            cursor = data.get("pagination", {}).get("cursor")
+            if not cursor or not data["data"]:
+                return
+
+    def streams(self, data):
+        """Returns the stream records in a streams response."""
+        return [
+            Stream(
+                name=i["user_login"],
+                display_name=i["user_name"],
+                channel_id=str(i["user_id"]),
+                url=f"https://www.twitch.tv/{i['user_login']}",
+                game=i["game_name"],
+                viewers=i["viewer_count"],
+                status=i["title"],
+                language=i["language"],
+                started_at=i.get("started_at"),
+            )
+            for i in data["data"]
+        ]
+
+    def vod(self, item):
+        """Create a record from a videos result"""
+        # Durations look like 1h2m3s
+        length = 0
+        for amount, unit in re.findall(r"(\d+)([hms])", item["duration"]):
+            length += int(amount) * {"h": 3600, "m": 60, "s": 1}[unit]
+
+        return Vod(
+            name=item["user_login"],
+            channel_id=str(item["user_id"]),
+            title=item["title"],
+            url=item["url"],
+            game="",
+            views=item["view_count"],
+            length=length,
+            created_at=item["created_at"],
+            status=item["type"],
+        )
+
+
+# Supported values of the api config option
+APIS = {"kraken": Kraken, "helix": Helix}
+
+
+class Results(Sequence):
+    """Results of a query that are loaded a window at a time.
+    Windows are kept as they arrive instead of being copied into one growing list.
+    """
+
+    def __init__(self, window):
+        self.windows = [window]
+        self.starts = [0]
+        self.size = len(window)
+
+    def add(self, window):
+        """Append the next window of results."""
+        if window:
+            self.windows.append(window)
+            self.starts.append(self.size)
+            self.size += len(window)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for window in self.windows:
+            yield from window
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+
+            items = []
+            i = bisect_right(self.starts, start) - 1
+            while start < stop and i < len(self.windows):
+                part = self.windows[i][start - self.starts[i] : stop - self.starts[i]]
+                items.extend(part)
+                start += len(part)
+                i += 1
+            return items
+
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("Results index out of range")
+
+        i = bisect_right(self.starts, index) - 1
+        return self.windows[i][index - self.starts[i]]
+
+
+class Cache:
+    """LRU cache of responses, entries go stale after their ttl but are kept until evicted."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Returns (data, fresh) for the key, or None if it isn't cached."""
+        if key not in self.entries:
+            return None
+
+        self.entries.move_to_end(key)
+        data, expires = self.entries[key]
+        return data, monotonic() < expires
+
+    def put(self, key, data, ttl):
+        """Cache data for ttl seconds, evicting the least recently used entry if full."""
+        if self.size <= 0:
+            return
+
+        self.entries[key] = (data, monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+class History:
+    """Views visited in the TUI, for going back and ahead.
+    Each frame holds a view's query, state, data and selected position.
+    Only frames near the current one keep their data, the rest are refetched if revisited.
+    """
+
+    def __init__(self, size, keep_data):
+        self.size = max(size, 1)
+        self.keep_data = keep_data
+        self.frames = []
+        self.index = -1
+
+    def current(self):
+        """Returns the current frame, or None if nothing was visited yet."""
+        if self.frames:
+            return self.frames[self.index]
+        return None
+
+    def push(self, query, url, state, data, pos):
+        """Add a new view after the current one, dropping any frames ahead of it.
+        A view with the same url and state replaces the current one instead.
+        pos is the selected position in the view being left.
+        """
+        frame = self.current()
+        if frame and frame["url"] == url and frame["state"] == state:
+            frame["data"] = data
+            return
+
+        if frame:
+            frame["pos"] = pos
+
+        del self.frames[self.index + 1 :]
+        self.frames.append({"query": query, "url": url, "state": state, "data": data, "pos": 0})
+        del self.frames[: -self.size]
+        self.index = len(self.frames) - 1
+        self.evict()
+
+    def update(self, url, data):
+        """Replace the data of the current frame, if it is showing url."""
+        frame = self.current()
+        if frame and frame["url"] == url:
+            frame["data"] = data
+
+    def back(self, pos):
+        """Move to the previous frame and return it, saving pos in the current one."""
+        return self.move(-1, pos)
+
+    def ahead(self, pos):
+        """Move to the next frame and return it, saving pos in the current one."""
+        return self.move(1, pos)
+
+    def move(self, step, pos):
+        """Move step frames from the current one and return the new frame."""
+        if not 0 <= self.index + step < len(self.frames):
+            return None
+
+        self.frames[self.index]["pos"] = pos
+        self.index += step
+        self.evict()
+        return self.frames[self.index]
+
+    def evict(self):
+        """Drop the data of frames too far from the current one, keeping their queries."""
+        for i, frame in enumerate(self.frames):
+            if abs(i - self.index) > self.keep_data:
+                frame["data"] = None
+
+
+class RateLimit:
+    """Paces requests to the api's quota, read from its Ratelimit-* response headers.
+    Requests are interactive unless sent inside bulk(), e.g. imports, ID lookups,
+    prefetches and background refreshes. Bulk requests leave BULK_RESERVE of the quota
+    to interactive ones, so they can't starve them. Apis without the headers aren't paced.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = 0  # monotonic time the quota refills
+        self.local = local()
+
+    @contextmanager
+    def bulk(self, on=True):
+        """Requests sent by this thread in the block are bulk, or interactive with on=False."""
+        old = self.is_bulk()
+        self.local.bulk = on
+        try:
+            yield
+        finally:
+            self.local.bulk = old
+
+    def is_bulk(self):
+        return getattr(self.local, "bulk", False)
+
+    def bind(self, func, bulk=None):
+        """Wrap func to send its requests as bulk or not, for running on another thread.
+        Defaults to the calling thread's setting."""
+        if bulk is None:
+            bulk = self.is_bulk()
+
+        def run(*args):
+            with self.bulk(bulk):
+                return func(*args)
+
+        return run
+
+    def wait_time(self):
+        """Seconds until the quota allows another request, 0 if it does now.
+        The request is taken from the quota when it does."""
+        with self.lock:
+            if self.remaining is None:
+                return 0
+
+            now = monotonic()
+            if now >= self.reset:
+                self.remaining = None  # Refilled, the next response tells us by how much
+                return 0
+
+            reserve = int(self.limit * BULK_RESERVE) if self.limit and self.is_bulk() else 0
+            if self.remaining > reserve:
+                self.remaining -= 1
+                return 0
+            return self.reset - now
+
+    def acquire(self, cancel=None):
+        """Wait until the quota allows a request. Returns False if cancelled first."""
+        delay = self.wait_time()
+        while delay:
+            if cancel and cancel.wait(min(delay, 1)):
+                return False
+            elif not cancel:
+                sleep(min(delay, 1))
+            delay = self.wait_time()
+        return True
+
+    def update(self, headers):
+        """Read the quota from a response's headers."""
+        try:
+            remaining = int(headers["Ratelimit-Remaining"])
+            reset = float(headers["Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            return
+
+        with self.lock:
+            self.remaining = remaining
+            self.reset = monotonic() + max(reset - time(), 0)
+            if "Ratelimit-Limit" in headers and headers["Ratelimit-Limit"].isdigit():
+                self.limit = int(headers["Ratelimit-Limit"])
+
+    def hold(self, seconds):
+        """Stop sending requests for a while, after being told to back off."""
+        with self.lock:
+            self.remaining = 0
+            self.reset = max(self.reset, monotonic() + seconds)
+
+
+class Stats:
+    """Outcomes and timings of recent requests, cache lookups and draws.
+    Shown by the stats overlay, and appended as json lines to stats_log if set.
+    Requests are recorded from worker threads, so changes hold the lock.
+    """
+
+    def __init__(self, size=100, log_path=""):
+        self.recent = deque(maxlen=size)
+        self.counts = {"requests": 0, "failed": 0, "retries": 0, "bytes": 0}
+        self.cache = {"hit": 0, "stale": 0, "prefetched": 0, "miss": 0}
+        self.draw_time = 0
+        self.lock = Lock()
+        self.log_path = path.expanduser(log_path) if log_path else ""
+        self.log_file = None
+
+    def request(self, record):
+        """Record a finished request, see Query.fetch for its fields."""
+        with self.lock:
+            self.recent.append(record)
+            self.counts["requests"] += 1
+            self.counts["failed"] += not record["ok"] and record.get("error") != "cancelled"
+            self.counts["retries"] += max(record["attempts"] - 1, 0)
+            self.counts["bytes"] += record["bytes"]
+            self.write_log(dict(record, event="request"))
+
+    def cache_lookup(self, url_class, result):
+        """Record whether a request was answered from the cache, result is a key of self.cache."""
+        with self.lock:
+            self.cache[result] += 1
+            self.write_log({"event": "cache", "class": url_class, "result": result})
+
+    def drawn(self, seconds):
+        """Record how long the last draw of both windows took."""
+        self.draw_time = seconds * 1000
+
+    def write_log(self, entry):
+        """Append an entry to stats_log, if set. Call with the lock held."""
+        if not self.log_path:
+            return
+
+        try:
+            if self.log_file is None:
+                self.log_file = open(self.log_path, "a")
+            self.log_file.write(json.dumps(dict(entry, time=round(time(), 3))) + "\n")
+            self.log_file.flush()
+        except OSError:
+            self.log_path = ""  # Don't retry a log we can't write every request
+
+    def lines(self):
+        """Returns the stats as lines of text, latest requests first."""
+        with self.lock:
+            recent = list(self.recent)
+            counts = dict(self.counts)
+            cache = dict(self.cache)
+
+        lines = [
+            f"Requests: {counts['requests']}, failed: {counts['failed']}, "
+            f"retries: {counts['retries']}",
+            f"Received: {counts['bytes'] / 1024:.1f}KiB",
+            f"Cache: {cache['hit']} hit, {cache['stale']} stale, "
+            f"{cache['prefetched']} prefetched, {cache['miss']} miss",
+            f"Draw: {self.draw_time:.1f}ms",
+            "",
+        ]
+        if recent:
+            total = sorted(i["total"] for i in recent)
+            lines.append(
+                f"Last {len(total)}: p50 {total[len(total) // 2]:.0f}ms, max {total[-1]:.0f}ms"
+            )
+        for record in reversed(recent):
+            status = ",".join(str(i) for i in record["status"]) or record.get("error", "-")
+            lines.append(
+                f"{record['class']} {status} {record['ttfb']:.0f}/{record['total']:.0f}ms "
+                f"{record['bytes'] / 1024:.1f}KiB"
+            )
+        return lines
+
+    def close(self):
+        """Close stats_log, if it was opened."""
+        if self.log_file:
+            self.log_file.close()
+
+
 class Query:
     """Make requests to Twitch and store results."""
 
     def __init__(self):
-        self.cache = []
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.version = 0
         self.data = []
         self.query = ["topgames", None]
         self.results_limit = config.cp.getint("twitch", "results_limit")
         self.retry_limit = config.cp.getint("twitch", "retry_limit")
+        self.timeout = config.cp.getfloat("twitch", "timeout")
+        self.pool_size = max(config.cp.getint("twitch", "pool_size"), 1)
         self.results = 0
-        self.state_cache = "top"
         self.url = ""
+        self.history = History(
+            config.cp.getint("ui", "history_size"), config.cp.getint("ui", "history_data")
+        )
+        self.pending = None
+        self.importing = None
+        self.imported = (0, None)
+        self.import_notice = None
+        self.more_failed = None
+        self.stats = Stats(log_path=config.cp["twitch"]["stats_log"])
+        self.limits = RateLimit()
+        self.stale = False
+        self.default_view = None
+        self.worker = ThreadPoolExecutor(self.pool_size)
+        self.responses = Cache(config.cp.getint("twitch", "cache_size"))
+        self.prefetcher = ThreadPoolExecutor(max(config.cp.getint("twitch", "prefetch"), 1))
+        self.prefetches = {}
+        self.selection = None
+        self.selected_at = 0
+        self.fetched_at = 0
+
+        # Client side filter and sort of the shown results, see items()
+        self.filter = ""
+        self.sort = "default"
+        self.index = None
+        self.matched = None
+        self.shown = None
+
+        if config.cp["twitch"]["api"] not in APIS:
+            raise ValueError("Config Error: api is invalid")
+        self.api = APIS[config.cp["twitch"]["api"]](self)
+        self._session = None
+        self.session_lock = Lock()
+
+        # Ask a running daemon for the online followed streams, off when we are the daemon
+        self.use_daemon = True
+
+    @property
+    def data(self):
+        """The shown results. Replacing them bumps self.version,
+        so the interface knows to redraw. Call changed() after changing them in place."""
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.changed()
+
+    def changed(self):
+        """Note that the shown results changed."""
+        self.version += 1
+
+    @property
+    def session(self):
+        """Session reusing connections to the api instead of reconnecting every request.
+        Made on first use, importing requests takes longer than most CLI commands.
+        The first requests can come from several pool threads at once, only one makes it."""
+        global requests
+        if self._session is None:
+            with self.session_lock:
+                if self._session is None:
+                    import requests
+
+                    session = requests.Session()
+                    session.headers.update(self.api.headers())
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=self.pool_size, pool_maxsize=self.pool_size
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
 
-    def request(self, req=None, state=None):
+    def request(self, req=None, state=None, on_done=None, use_cache=True):
         """Fire off request and set data json. Optionally sets the state.
-        Retry up to X times on fail."""
+        With the TUI running the request is sent in the background, and the
+        data is set once poll() sees it finish. on_done is called after the data is set.
+        Cached responses are used straight away, stale ones are refetched in the background.
+        """
 
-        if ui and self.cache:
+        if ui and self.history.frames:
             ui.win_blink()
 
-        self.prep_url(req)
+        query, url = self.prep_url(req)
+        ttl = CACHE_TTL.get(query[0], 0)
+
+        def done(data):
+            if data is not None:
+                self.responses.put(url, data, ttl)
+            self.set_data(query, url, data, state)
+            if on_done:
+                on_done()
+
+        cached = self.responses.get(url) if use_cache and ui else None
+        if use_cache and ui:
+            if cached:
+                result = "hit" if cached[1] else "stale"
+            else:
+                result = "prefetched" if url in self.prefetches else "miss"
+            self.stats.cache_lookup(self.api.url_class(url), result)
+
+        if cached:
+            data, fresh = cached
+            self.cancel()
+            self.set_data(query, url, data, state)
+            self.stale = not fresh
+            if on_done:
+                on_done()
+            if not fresh:
+                self.submit(
+                    lambda cancel: self.fetch_query(query, url, cancel),
+                    lambda data: self.revalidated(url, data, ttl),
+                )
+        elif ui and url in self.prefetches:
+            # Already on its way, wait for the prefetch instead of sending it again
+            future = self.prefetches.pop(url)[0]
+            self.submit(lambda cancel: future.result(), done)
+        elif ui:
+            fresh = not use_cache
+            self.submit(lambda cancel: self.fetch_query(query, url, cancel, fresh), done)
+        else:
+            done(self.fetch_query(query, url))
+
+    def revalidated(self, url, data, ttl):
+        """Replace a stale response with the refetched one, updating it in place if shown."""
+        if data is None:
+            return
+
+        self.responses.put(url, data, ttl)
+        self.history.update(url, data)
+        if self.url == url:
+            self.stale = False
+            self.fetched_at = monotonic()
+            self.data = data
+            self.set_results()
+            if ui.get_pos() >= self.results:
+                ui.reset_page()
+
+    def set_data(self, query, url, data, state=None):
+        """Store the results of a finished request, adding them to the history."""
+        if url != self.url:
+            self.filter = ""  # Filters only apply to the results they were typed over
+        self.query = query
+        self.url = url
+        self.stale = False
+
+        if data is None:
+            self.data = None
+            return
 
-        for _ in range(self.retry_limit):
+        self.data = data
+        self.fetched_at = monotonic()
+        if ui:
+            pos = ui.get_pos()
+            if state:
+                ui.set_state(state)
+            self.history.push(query, url, ui.state, data, pos)
+
+    def restore(self, frame):
+        """Show a view from the history, refetching its data if it was dropped."""
+        self.cancel()
+        if frame["url"] != self.url:
+            self.filter = ""
+        self.query = frame["query"]
+        self.url = frame["url"]
+        self.stale = False
+        ui.state = frame["state"]
+
+        data = frame["data"]
+        if data is None:
+            cached = self.responses.get(frame["url"])
+            if cached:
+                data = frame["data"] = cached[0]
+
+        if data is None:
+            self.data = None
+            url = frame["url"]
+            ttl = CACHE_TTL.get(frame["query"][0], 0)
+            self.submit(
+                lambda cancel: self.fetch_query(frame["query"], url, cancel),
+                lambda data: self.revalidated(url, data, ttl),
+            )
+        else:
+            self.data = data
+
+        self.set_results()
+        ui.set_pos(frame["pos"])
+
+    def submit(self, job, on_done):
+        """Run job(cancel) on a background thread, replacing any pending job.
+        The replaced job is cancelled and its result thrown away.
+        on_done(result) is called by poll() from the main loop.
+        """
+        self.cancel()
+        cancel = Event()
+        self.pending = (self.worker.submit(job, cancel), on_done, cancel)
+
+    def poll(self):
+        """Finish the pending job if it's done. Returns True if it finished."""
+        if not self.pending or not self.pending[0].done():
+            return False
+
+        future, on_done, _ = self.pending
+        self.pending = None
+        on_done(future.result())
+        return True
+
+    def import_follows(self, username, overwrite=False):
+        """Import a user's follows in the background, apart from the pending job
+        so requests sent meanwhile don't cancel it. Pages are queued as they arrive
+        for poll_import() to merge. Returns False if an import is already running."""
+        if self.importing:
+            return False
+
+        pages = deque()
+        future = self.worker.submit(lambda: pages.extend(self.get_user_follows(username)))
+        self.import_notice = None
+        self.importing = (future, pages, overwrite)
+        self.imported = (0, None)
+        return True
+
+    def poll_import(self):
+        """Merge the pages of follows that arrived, with (fetched, total) in imported.
+        Once the import finishes, its outcome is left in import_notice for the status line,
+        and the followed view is refreshed if it is shown.
+        Returns True if anything was merged or it finished."""
+        if not self.importing:
+            return False
+
+        future, pages, overwrite = self.importing
+        done = future.done()
+        merged = bool(pages)
+        while pages:
+            follows, total = pages.popleft()
+            fetched = self.imported[0]
+            config.merge_follows([(follows, total)], overwrite and fetched == 0)
+            self.imported = (fetched + len(follows), total)
+
+        if not done:
+            return merged
+
+        self.importing = None
+        fetched, total = self.imported
+        try:
+            future.result()
+        except Exception as err:  # Raised in the worker, shown instead of lost with the future
+            self.import_notice = f"import failed: {type(err).__name__}"
+            return True
+
+        if total is None:
+            self.import_notice = "import: user or follows not found"
+            return True
+        self.import_notice = f"imported: {fetched}/{total}"
+
+        # Unless another view was asked for meanwhile
+        if ui.state == "follow" and not self.pending:
+            self.query = ["channel", config.followed_ids()]
+            user_input.request.refresh()
+        return True
+
+    def cancel(self):
+        """Cancel the pending job, if any."""
+        if self.pending:
+            self.pending[0].cancel()
+            self.pending[2].set()
+            self.pending = None
+
+    def fetch_query(self, query, url, cancel=None, fresh=False):
+        """Fetch the results for a prepared query, as records.
+        Online followed streams come from the daemon instead, if one is running.
+        fresh makes the daemon refetch them instead of answering from its last poll."""
+        if query[0] == "channel" and self.use_daemon:
+            data = self.ask_daemon(unquote(query[1]), fresh)
+            if data is not None:
+                return data
+
+        return self.api.results(query, url, cancel)
+
+    def ask_daemon(self, ids, fresh=False):
+        """Get the online streams for the channel IDs from the daemon, refetched if fresh.
+        Returns None if no daemon is running or it failed to answer."""
+        if not path.exists(config.socket_path):
+            return None
+
+        import socket
+
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(10)
+                sock.connect(config.socket_path)
+                sock.sendall(f"{'!' if fresh else ''}{ids}\n".encode("utf-8"))
+                reply = sock.makefile("rb").readline()
+            data = json.loads(reply)
+        except (OSError, ValueError):
+            return None
+
+        if not data:
+            return None
+        return self.load_records(data)
+
+    def prefetch(self):
+        """Fetch the views the selected item leads to into the cache,
+        once the selection has stayed put for PREFETCH_DELAY.
+        Prefetches for a previous selection are cancelled.
+        """
+        # Cache what has arrived
+        for url, (future, ttl, _) in list(self.prefetches.items()):
+            if future.done():
+                del self.prefetches[url]
+                if future.result() is not None:
+                    self.responses.put(url, future.result(), ttl)
+
+        if config.cp.getint("twitch", "prefetch") <= 0:
+            return
+
+        selection = (ui.state, ui.f_filter, self.url, ui.get_pos())
+        if selection != self.selection:
+            self.selection = selection
+            self.selected_at = monotonic()
+            self.cancel_prefetch()
+            return
+
+        # Wait for the selection to settle, and don't compete with the user's own requests
+        if self.selected_at is None or monotonic() - self.selected_at < PREFETCH_DELAY:
+            return
+        if self.pending:
+            return
+        self.selected_at = None
+
+        for req in self.next_queries():
+            query, url = self.prep_url(req)
+            cached = self.responses.get(url)
+            if url in self.prefetches or (cached and cached[1]):
+                continue
+
+            cancel = Event()
+            future = self.prefetcher.submit(
+                self.limits.bind(self.fetch_query, bulk=True), query, url, cancel
+            )
+            self.prefetches[url] = (future, CACHE_TTL.get(query[0], 0), cancel)
+
+    def auto_refresh(self):
+        """Refetch the online followed streams every follow_refresh seconds in the background.
+        The shown list is patched with the changes instead of being replaced."""
+        interval = config.cp.getint("ui", "follow_refresh")
+        if interval <= 0 or self.pending or not self.data:
+            return
+        if ui.state != "follow" or ui.f_filter != "online":
+            return
+        if monotonic() - self.fetched_at < interval:
+            return
+
+        query, url, data = self.query, self.url, self.data
+        self.fetched_at = monotonic()
+        self.submit(
+            self.limits.bind(lambda cancel: self.fetch_query(query, url, cancel), bulk=True),
+            lambda new: self.patch_streams(url, data, new),
+        )
+
+    def patch_streams(self, url, data, new):
+        """Update the shown streams from a refetch of the same query, matching them by channel ID.
+        Streams still live are updated in place and keep their records, the selection stays
+        on the same channel even if the order changed. The left window and its caches are
+        only redone if the shown streams, their order or their labels changed.
+        """
+        if new is None or self.data is not data:
+            return
+
+        streams = data["streams"]
+        shown = self.items()
+        pos = ui.get_pos()
+        selected = shown[pos].channel_id if pos < len(shown) else None
+        before = [i.channel_id for i in shown]
+
+        old = {i.channel_id: i for i in streams}
+        patched = []
+        relabeled = False
+        for stream in new["streams"]:
+            record = old.get(stream.channel_id)
+            if record:
+                # Rows show the game, filters also match the title
+                relabeled |= record.game != stream.game
+                relabeled |= bool(self.filter) and record.status != stream.status
+                record.viewers = stream.viewers
+                record.status = stream.status
+                record.game = stream.game
+                patched.append(record)
+            else:
+                patched.append(stream)
+
+        streams[:] = patched
+        data["_total"] = len(patched)
+        self.responses.put(url, data, CACHE_TTL["channel"])
+        # The sorted list is kept by version, new viewer counts can reorder it
+        self.shown = None
+        if relabeled or [i.channel_id for i in self.items()] != before:
+            self.changed()
+        else:
+            ui.drawn_r = None
+        self.set_results()
+
+        ids = [i.channel_id for i in self.items()]
+        if selected in ids:
+            ui.set_pos(ids.index(selected))
+        elif pos >= self.results:
+            ui.reset_page()
+
+    def next_queries(self):
+        """Returns the queries the selected item's forward and vods keys would send."""
+        if not ui.cur_page or ui.sel >= len(ui.cur_page):
+            return []
+
+        if ui.state == "top":
+            return [["game", ui.cur_page[ui.sel].name]]
+        if ui.state == "search" or (ui.state == "follow" and ui.f_filter == "online"):
+            return [["vods", ui.cur_page[ui.sel].channel_id]]
+        return []
+
+    def cancel_prefetch(self):
+        """Cancel prefetches that haven't finished."""
+        for future, _, cancel in self.prefetches.values():
+            future.cancel()
+            cancel.set()
+        self.prefetches = {}
+
+    def load_more(self):
+        """Fetch the next window of results for the shown query in the background.
+        The window is appended to the data if it is still shown when it arrives.
+        """
+        if (
+            not config.cp.getboolean("ui", "infinite_scroll")
+            or self.pending
+            or not self.data.get("_next")
+        ):
+            return
+
+        # A window failed to load, wait a while before asking again
+        if self.more_failed and self.more_failed[0] is self.data:
+            if monotonic() < self.more_failed[1]:
+                return
+        self.more_failed = None
+
+        data = self.data
+        query = self.query
+
+        def done(more):
+            if self.data is not data:
+                return
+            if more is None:
+                self.more_failed = (data, monotonic() + RETRY_CAP)
+                return
+
+            key = next(key for key in RECORD_TYPES if key in data)
+            if not isinstance(data[key], Results):
+                data[key] = Results(data[key])
+
+            # Lists can shift between windows, skip anything already shown
+            seen = {getattr(i, "url", i.name) for i in data[key]}
+            new = [i for i in more[key] if getattr(i, "url", i.name) not in seen]
+            data[key].add(new)
+            # Nothing new means the end of the list, asking again would get the same window
+            data["_next"] = more["_next"] if new else None
+            self.changed()
+            self.set_results()
+
+        self.submit(lambda cancel: self.api.more(query, data["_next"], cancel), done)
+
+    def load_records(self, data):
+        """Turn records saved by dump_records back into records."""
+        records = {"_total": data["_total"]}
+        for key, record in RECORD_TYPES.items():
+            if key in data:
+                records[key] = [record(**i) for i in data[key]]
+        return records
+
+    def dump_records(self, data):
+        """Turn records into json serializable dicts."""
+        dump = {"_total": data["_total"]}
+        for key in RECORD_TYPES:
+            if key in data:
+                dump[key] = [i.as_dict() for i in data[key]]
+        return dump
+
+    def fetch(self, url, cancel=None):
+        """GET the url and return the decoded json, or None on failure.
+        Retry up to X times on errors, 429s and 5xxs, waiting a random time up to an
+        exponential backoff before each retry, or as long as the api asks in Retry-After.
+        Gives up if Retry-After asks for longer than RETRY_CAP.
+        Requests are paced to the rate limit by self.limits. Gives up early if cancel is set.
+        Does not touch the stored data. Each call is recorded in the stats:
+        the url's class, attempts made, status codes, bytes received, and the time
+        to the last response's headers (ttfb) and in total, in ms."""
+        start = perf_counter()
+        record = {
+            "class": self.api.url_class(url),
+            "attempts": 0,
+            "status": [],
+            "bytes": 0,
+            "ttfb": 0,
+        }
+        data = None
+
+        for attempt in range(self.retry_limit):
+            if (cancel and cancel.is_set()) or not self.limits.acquire(cancel):
+                record["error"] = "cancelled"
+                break
+
+            record["attempts"] += 1
+            delay = uniform(0, min(RETRY_CAP, RETRY_BASE * 2 ** attempt))
             try:
-                headers = {
-                    "Accept": "application/vnd.twitchtv.v5+json",
-                    "Client-ID": config.cp["twitch"]["client_id"],
-                }
-                ret = requests.get(self.url, headers=headers, timeout=5)
-                if ret.status_code != 200:
-                    continue
-
-                try:
-                    self.cache = self.data
-                    self.data = ret.json()
-                    if ui:
-                        self.state_cache = ui.state
-                        if state:
-                            ui.set_state(state)
-                    return
-                except ValueError:
-                    self.data = None
-            except requests.exceptions.RequestException:
-                sleep(3)
-        self.data = None
+                ret = self.session.get(url, timeout=self.timeout)
+                self.limits.update(ret.headers)
+                record["status"].append(ret.status_code)
+                record["bytes"] += len(ret.content)
+                record["ttfb"] = round(ret.elapsed.total_seconds() * 1000, 1)
+
+                if ret.status_code == 200:
+                    try:
+                        data = ret.json()
+                        break
+                    except ValueError:
+                        record["error"] = "invalid json"
+                elif ret.status_code == 429 or ret.status_code >= 500:
+                    retry_after = self.retry_after(ret.headers)
+                    if retry_after is not None and retry_after > RETRY_CAP:
+                        record["error"] = "retry-after too long"
+                        break  # Not worth blocking every request for
+                    if retry_after is not None:
+                        delay = retry_after
+                        self.limits.hold(retry_after)
+                else:
+                    break  # Asking again won't change the answer
+            except requests.exceptions.RequestException as err:
+                record["error"] = type(err).__name__
+
+            if attempt + 1 < self.retry_limit:
+                if cancel and cancel.wait(delay):
+                    record["error"] = "cancelled"
+                    break
+                elif not cancel:
+                    sleep(delay)
+
+        record["total"] = round((perf_counter() - start) * 1000, 1)
+        record["ok"] = data is not None
+        self.stats.request(record)
+        return data
+
+    def retry_after(self, headers):
+        """Seconds a response's Retry-After header asks to wait, None without one."""
+        value = headers.get("Retry-After", "").strip()
+        if value.isdigit():
+            return int(value)
+
+        from email.utils import parsedate_to_datetime
+
+        try:
+            return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    def fetch_all(self, urls, cancel=None):
+        """Fetch the urls in parallel, returns the json of each in order.
+        Returns None if any of them fail.
+        """
+        if not urls:
+            return []
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(min(len(urls), self.pool_size)) as pool:
+            pages = list(pool.map(self.limits.bind(lambda url: self.fetch(url, cancel)), urls))
+
+        if None in pages:
+            return None
+        return pages
 
     def prep_url(self, req=None):
-        """Prepares the url for the request. Defaults to last request made"""
+        """Prepares the url for the request. Defaults to last request made.
+        Returns the query and its url."""
         if req:
-            self.query = req
             if req[1]:
                 req[1] = quote(req[1])
         else:
             req = self.query
 
-        url = "https://api.twitch.tv/kraken/"
-
-        if req[0] == "topgames":
-            url += f"games/top?limit={self.results_limit}"
-        elif req[0] == "topstreams":
-            url += f"streams?limit={self.results_limit}"
-        elif req[0] == "game":
-            url += f"streams?limit={self.results_limit}&game={req[1]}"
-            if config.cp["twitch"]["lang"] != "":
-                url += f"&language={config.cp['twitch']['lang']}"
-        elif req[0] == "channel":
-            url += f"streams/?channel={req[1]}"
-        elif req[0] == "stream":
-            url += f"search/streams?limit={self.results_limit}&query={req[1]}"
-        elif req[0] == "vods":
-            url += f"channels/{req[1]}/videos?limit={self.results_limit}"
-        elif req[0] == "get_id":
-            url += f"users?login={req[1]}"
-        elif req[0] == "get_follows":
-            url += f"users/{req[1]}/follows/channels?limit={self.results_limit}"
-        else:
-            raise ValueError("Invalid Type Passed")
-
-        self.url = url
+        return req, self.api.url(req)
 
     def set_results(self):
         """Count the number of results from the request."""
         if self.data:
-            if ui.state == "top":
-                self.results = len(self.data["top"])
-            elif (ui.state == "search") or (ui.state == "follow" and ui.f_filter == "online"):
-                self.results = len(self.data["streams"])
-            elif ui.state == "follow" and ui.f_filter == "all":
-                self.results = len(config.followed)
-            elif ui.state == "vods":
-                self.results = len(self.data["videos"])
+            self.results = len(self.items())
         else:
             self.results = 0
 
+    def items(self):
+        """Returns the results shown in the current state, after the filter and sort.
+        Filtered lists are kept until the data, view, filter or sort changes."""
+        if not self.data:
+            return []
+
+        if ui.state == "top":
+            items = self.data["top"]
+        elif (ui.state == "search") or (ui.state == "follow" and ui.f_filter == "online"):
+            items = self.data["streams"]
+        elif ui.state == "follow" and ui.f_filter == "all":
+            items = list(config.followed)
+        elif ui.state == "vods":
+            items = self.data["videos"]
+        else:
+            return []
+
+        if not self.filter and self.sort == "default":
+            return items
+
+        view = (self.version, ui.state, ui.f_filter, len(items), self.filter, self.sort)
+        if self.shown and self.shown[0] == view:
+            return self.shown[1]
+
+        if self.filter:
+            items = [item for text, item in self.matches(items)]
+
+        if self.sort == "viewers":
+            items = sorted(items, key=lambda i: getattr(i, "viewers", getattr(i, "views", 0)) or 0)
+            items.reverse()
+        elif self.sort == "name":
+            items = sorted(items, key=lambda i: self.search_text(i))
+        elif self.sort == "uptime":
+            # Longest running first, results without a start time last
+            items = sorted(items, key=lambda i: self.started(i) or "~")
+
+        self.shown = (view, items)
+        return items
+
+    def matches(self, items):
+        """Returns the (text, item) pairs of the index matching the filter.
+        While typing, only the matches of the shorter filter are checked again."""
+        view, last, pairs = self.matched or (None, None, None)
+        index = self.search_index(items)
+        if view != self.index[0] or not self.filter.startswith(last):
+            pairs = index
+
+        pairs = [i for i in pairs if self.fuzzy(i[0])]
+        self.matched = (self.index[0], self.filter, pairs)
+        return pairs
+
+    def fuzzy(self, text):
+        """Check if the filter's characters appear in text in order, with anything in between."""
+        pos = 0
+        for char in self.filter.lower():
+            pos = text.find(char, pos) + 1
+            if not pos:
+                return False
+        return True
+
+    def started(self, item):
+        """Returns when a stream went live or a vod was recorded, as an ISO 8601 string."""
+        return getattr(item, "started_at", None) or getattr(item, "created_at", None)
+
+    def search_index(self, items):
+        """Returns (lowercase text, item) pairs for filters to match against.
+        Built once per response and view, so filtering as you type stays cheap."""
+        view = (self.version, ui.state, ui.f_filter, len(items))
+        if self.index is None or self.index[0] != view:
+            self.index = (view, [(self.search_text(i), i) for i in items])
+        return self.index[1]
+
+    def search_text(self, item):
+        """Returns the lowercase text filters match against: name, game, title
+        and the tags of followed channels."""
+        if isinstance(item, str):
+            name, text = item, item
+        else:
+            fields = ("display_name", "name", "title", "game", "status")
+            name = getattr(item, "name", None)
+            text = " ".join(str(getattr(item, i)) for i in fields if hasattr(item, i))
+
+        tags = config.followed.tags.get(name)
+        if tags:
+            text += " " + " ".join(f"#{i}" for i in sorted(tags))
+        return text.lower()
+
     def get_twitch_id(self, name):
         """Takes a twitch channel username, Returns its corresponding ID"""
-        self.request(["get_id", name])
-        if self.data["_total"] > 0:
-            return self.data["users"][0]["_id"]
+        return self.api.ids([name]).get(name.lower())
+
+    def get_twitch_ids(self, names):
+        """Takes a list of twitch channel usernames, looks them up in batches.
+        Returns a dict of lowercase name: ID, with None for unknown channels.
+        Names in a batch that failed to fetch are left out.
+        """
+        with self.limits.bulk():
+            return self.api.ids(names)
+
+    def get_follows(self, user_id):
+        """Yields ([(name, ID), ...], total) for each page of the channels a user follows."""
+        with self.limits.bulk():
+            yield from self.api.follows(user_id)
+
+    def get_user_follows(self, username):
+        """Yields each page of follows for a twitch username, none if not found."""
+        user_id = self.get_twitch_id(username)
+        if user_id:
+            yield from self.get_follows(user_id)
 
     def get_default_view(self):
         """Request for default view on program start"""
         default_view = config.cp["ui"]["default_state"]
+        saved = self.load_view(default_view)
+
+        def done():
+            self.default_view = (default_view, self.url, saved)
+
         if default_view == "games":
-            self.request(["topgames", None], "top")
+            self.request(["topgames", None], "top", done)
         elif default_view == "followed":
-            self.request(["channel", ",".join(config.followed.values())], "follow")
+            self.request(["channel", config.followed_ids()], "follow", done)
         elif default_view == "streams":
-            self.request(["stream", " "], "search")
+            self.request(["stream", " "], "search", done)
         else:
             raise ValueError("Config Error: default_state is invalid")
 
-        self.cache = self.data
-        self.state_cache = ui.state
+    def load_view(self, name):
+        """Load the response saved for a view last session into the cache as stale.
+        Lets the view be drawn right away while the live request is made.
+        Returns the saved data."""
+        try:
+            with open(f"{config.cache_dir}/{name}.json", "r") as file:
+                saved = json.load(file)
+            data = self.load_records(saved["data"])
+            self.responses.put(saved["url"], data, 0)
+            return data
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def save_default_view(self):
+        """Save the latest response for the default view, for the next startup."""
+        if not self.default_view:
+            return
+
+        name, url, saved = self.default_view
+        cached = self.responses.get(url)
+        # Nothing new was fetched this session
+        if not cached or cached[0] is saved:
+            return
+
+        file_path = f"{config.cache_dir}/{name}.json"
+        if not path.isdir(config.cache_dir):
+            makedirs(config.cache_dir)
+        write_atomic(file_path, json.dumps({"url": url, "data": self.dump_records(cached[0])}))
+
+
+class Daemon:
+    """Keeps the online followed streams warm in the background,
+    serving them to the TUI and CLI over a unix socket."""
+
+    def __init__(self):
+        self.interval = config.cp.getint("twitch", "daemon_refresh")
+        self.ids = config.followed_ids()
+        self.online = None
+        self.fetched_at = 0
+        self.lock = Lock()
+        self.server = None
+        twitch.use_daemon = False
+
+    def run(self):
+        """Serve until interrupted, removing the socket on exit."""
+        if self.alive():
+            print(f"Daemon already running on {config.socket_path}")
+            return
+
+        from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+
+        class Handler(DaemonHandler, StreamRequestHandler):
+            pass
+
+        try:
+            makedirs(path.dirname(config.socket_path), exist_ok=True)
+            if path.exists(config.socket_path):
+                unlink(config.socket_path)  # Left behind by a daemon that was killed
+            self.server = ThreadingUnixStreamServer(config.socket_path, Handler)
+        except OSError as err:
+            print(f"Could not listen on {config.socket_path}: {err}")
+            return
+
+        self.server.daemon_threads = True
+        self.server.daemon = self
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+        Thread(target=self.poll, daemon=True).start()
+
+        print(f"Listening on {config.socket_path}")
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            unlink(config.socket_path)
+
+    def alive(self):
+        """Check if another daemon accepts connections on the socket."""
+        if not path.exists(config.socket_path):
+            return False
+
+        import socket
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(config.socket_path)
+            except OSError:
+                return False
+        return True
+
+    def poll(self):
+        """Refetch the tracked channels every interval."""
+        while True:
+            with twitch.limits.bulk():
+                self.refresh(self.ids)
+            sleep(max(self.interval, 1))
+
+    def refresh(self, ids):
+        """Fetch the online streams for the IDs and start tracking them.
+        Returns the data, or None on failure."""
+        req, url = twitch.prep_url(["channel", ids])
+        data = twitch.fetch_query(req, url)
+        if data is None:
+            return None
+
+        with self.lock:
+            self.ids = ids
+            self.online = data
+            self.fetched_at = monotonic()
+        return data
+
+    def streams(self, ids, fresh=False):
+        """Returns the online streams for the IDs, from the last poll if it covered them
+        and is recent, or fetched now. fresh always fetches them now."""
+        wanted = set(ids.split(",")) if ids else set()
+        with self.lock:
+            online, tracked = self.online, set(self.ids.split(","))
+            age = monotonic() - self.fetched_at
+
+        if fresh or online is None or not wanted <= tracked or age > self.interval * 2:
+            online = self.refresh(ids)
+            if online is None:
+                return None
+
+        streams = [i for i in online["streams"] if i.channel_id in wanted]
+        return {"_total": len(streams), "streams": streams}
+
+
+class DaemonHandler:
+    """Answers a line of comma separated channel IDs with a line of the online streams as json,
+    or null if they couldn't be fetched. IDs starting with ! are refetched, e.g. for a refresh.
+    Mixed into a StreamRequestHandler by Daemon.run, socketserver is only imported there."""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return  # Closed without asking, e.g. by Daemon.alive
+
+        ids = line.decode("utf-8").strip()
+        fresh = ids.startswith("!")
+        data = self.server.daemon.streams(ids.lstrip("!"), fresh)
+        if data is not None:
+            data = twitch.dump_records(data)
+        self.wfile.write(json.dumps(data).encode("utf-8") + b"\n")
 
 
 class CLI:
@@ -934,13 +3221,18 @@ class CLI:
         self.arg_num = len(sys.argv)
         self.cur_arg = sys.argv[1]
 
+        # Commands that don't need the config or followed list loaded
+        self.standalone = ("-h", "--help", "-v")
+
         self.commands = {
             "-a": self.add_user_follow,
             "-d": self.delete_user_follow,
+            "-D": self.run_daemon,
             "-f": self.get_online_followed,
             "-h": self.display_help,
             "--help": self.display_help,
             "-i": self.import_user_follows,
+            "-t": self.tag_user_follow,
             "-v": self.version,
         }
 
@@ -948,6 +3240,14 @@ class CLI:
         """Gets the passed arg, then calls the respective function."""
 
         if self.cur_arg in self.commands:
+            if self.cur_arg not in self.standalone:
+                setup()
+                if config.unknown:
+                    print(
+                        f"Channels not found on twitch, kept without an ID: "
+                        f"{', '.join(config.unknown)}",
+                        file=sys.stderr,
+                    )
             self.commands[self.cur_arg]()
         else:
             print(f"Invalid Argument Passed: {self.cur_arg}")
@@ -966,6 +3266,9 @@ OPTIONS
        -d channel_name
               Delete a twitch channel from your followed list
 
+       -D     Run a daemon that keeps the online followed streams up to date.
+              -f and the TUI ask it instead of twitch while it is running.
+
        -f     Prints out any followed streams that are online.
 
        -h, --help
@@ -974,8 +3277,10 @@ OPTIONS
        -i channel_name (--overwrite)
               Import channels followed by channel_name into your followed list.
               Default is to append to your current followed list, add --overwrite to replace it.
-              NOTE: Currently limited to the results_limit (default: 75), large followed lists
-                    might not fully import.
+
+       -t channel_name (tag ...)
+              Set the tags of a followed channel, the TUI's filter matches them.
+              Leave out the tags to remove them.
 
        -v     Print version
         """
@@ -999,7 +3304,6 @@ OPTIONS
 
         config.followed[sys.argv[2]] = user_id
         print(f"Followed {sys.argv[2]}")
-        config.write_followed_list()
 
     def delete_user_follow(self):
         """Deletes a channel from your followed list"""
@@ -1013,16 +3317,32 @@ OPTIONS
 
         del config.followed[sys.argv[2]]
         print(f"Deleted {sys.argv[2]}")
-        config.write_followed_list()
+
+    def tag_user_follow(self):
+        """Sets the tags of a followed channel"""
+        if self.arg_num < 3:
+            print("Usage: reflex-curses -t channel_name (tag ...)")
+            return
+
+        if sys.argv[2] not in config.followed:
+            print(f"Channel {sys.argv[2]} not followed")
+            return
+
+        tags = [i.lstrip("#") for i in sys.argv[3:] if i.lstrip("#")]
+        config.followed.tag(sys.argv[2], tags)
+        if tags:
+            print(f"Tagged {sys.argv[2]}: {' '.join(tags)}")
+        else:
+            print(f"Removed the tags of {sys.argv[2]}")
 
     def get_online_followed(self):
         """Prints any online streams in the followed list"""
-        twitch.request(["channel", ",".join(config.followed.values())])
+        twitch.request(["channel", config.followed_ids()])
         if twitch.data:
             for stream in sorted(
-                twitch.data["streams"], key=lambda i: str(i["channel"]["display_name"]).lower(),
+                twitch.data["streams"], key=lambda i: i.display_name.lower()
             ):
-                print(stream["channel"]["display_name"])
+                print(stream.display_name)
 
     def import_user_follows(self):
         """Adds twitch user's follow list to your own"""
@@ -1037,25 +3357,85 @@ OPTIONS
         else:
             old_follows = len(config.followed)
 
-        config.import_follows_from_user(sys.argv[2], overwrite)
+        def progress(fetched, total):
+            print(f"Fetched {fetched}/{total} follows", end="\r", file=sys.stderr, flush=True)
 
-        if twitch.data:
+        result = config.import_follows_from_user(sys.argv[2], overwrite, progress)
+
+        if result:
+            fetched, total = result
+            print(file=sys.stderr)
+            if fetched < total:
+                print(f"Warning: only {fetched} of {total} follows could be fetched.")
             print(f"Imported {len(config.followed) - old_follows} new follows.")
             config.write_followed_list()
         else:
             print(f"Followed list for {sys.argv[2]} not found.")
 
+    def run_daemon(self):
+        """Runs the daemon in the foreground"""
+        Daemon().run()
+
     def version(self):
         """Prints version number"""
         print(f"{VERSION}")
 
 
+def write_atomic(file_path, text):
+    """Write text to a temp file next to file_path, then rename it over file_path.
+    A crash or full disk leaves either the old or the new file, never half of one.
+    The new file keeps the old one's permissions, the config can hold an OAuth token."""
+    with open(file_path + ".tmp", "w") as file:
+        if path.isfile(file_path):
+            fchmod(file.fileno(), S_IMODE(stat(file_path).st_mode))
+        file.write(text)
+        file.flush()
+        fsync(file.fileno())
+    replace(file_path + ".tmp", file_path)
+
+
+def setup():
+    """Load the config and followed list, and get ready to query twitch."""
+    global config, twitch
+    config = Config()
+    twitch = Query()
+    config.init_followed_list()
+
+
 def main():
+    """Runs the CLI command passed, or starts the TUI."""
+    global cli, curses, ui, user_input
+
+    if len(sys.argv) >= 2:
+        cli = CLI()
+        cli.arg_run()
+        return
+
+    import curses
+
+    setup()
+    ui = Interface()
+    user_input = Keybinds()
+    tui()
+
+
+def tui():
+    """Main loop of the TUI."""
     try:
         twitch.get_default_view()
 
         while user_input.cur_key != config.cp["keys"]["quit"]:
 
+            if twitch.poll():
+                ui.donothing = False
+            if twitch.poll_import():
+                ui.donothing = False
+            if ui.launcher.poll():
+                ui.donothing = False
+            ui.launcher.prefetch(user_input.launch.selected())
+            twitch.prefetch()
+            twitch.auto_refresh()
+
             if ui.donothing:
                 ui.donothing = False
             else:
@@ -1065,33 +3445,35 @@ def main():
                 if ui.check_term_size():
                     ui.warn_term_size()
                 else:
+                    start = perf_counter()
                     ui.draw_win_l()
                     ui.draw_win_r()
+                    curses.doupdate()
+                    twitch.stats.drawn(perf_counter() - start)
 
             user_input.input()
     finally:
+        twitch.cancel()
+        twitch.cancel_prefetch()
+        twitch.worker.shutdown(wait=False)
+        twitch.prefetcher.shutdown(wait=False)
         curses.nocbreak()
         ui.screen.keypad(0)
         curses.echo()
         curses.endwin()
+        twitch.save_default_view()
+        twitch.stats.close()
+        ui.launcher.close()
         config.write_config()
         config.write_followed_list()
 
 
-# Class Inits
-config = Config()
-twitch = Query()
-ui = None  # Dummy init for cli invocation
-
-config.init_followed_list()
-
-if len(sys.argv) >= 2:
-    cli = CLI()
-    cli.arg_run()
-    sys.exit()
-
-ui = Interface()
-user_input = Keybinds()
+# Class Inits, done by main() so importing doesn't touch the terminal, files or network
+config = None
+twitch = None
+ui = None  # Stays None for cli invocation
+user_input = None
+cli = None
 
 if __name__ == "__main__":
     main()